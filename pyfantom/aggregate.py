@@ -0,0 +1,200 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+
+class Aggregator:
+    """
+    Collapse the rows of an expression matrix by a key, e.g. CAGE peaks to genes.
+
+    The peak -> gene mapping is built once as a sparse indicator matrix (genes x peaks),
+    such that sum and mean are a single sparse matrix product. Median and max are computed
+    on the rows sorted by gene (sorted-segment reductions).
+
+    Rows with a missing key (None/NaN) are dropped, like peaks that are not
+    associated with a gene in notebook 07.
+
+    >>> agg = Aggregator(["g2", "g1", None, "g2", "g2"])
+    >>> exprs = np.array([[1, 2], [3, 4], [5, 6], [7, 8], [9, 1]], dtype=np.float32)
+    >>> list(agg.groups)
+    ['g1', 'g2']
+    >>> agg.aggregate(exprs, "sum")
+    array([[ 3.,  4.],
+           [17., 11.]], dtype=float32)
+    >>> agg.aggregate(exprs, "median")
+    array([[3., 4.],
+           [7., 2.]], dtype=float32)
+    >>> agg.aggregate(exprs, "max", chunk_size=1)
+    array([[3., 4.],
+           [9., 8.]], dtype=float32)
+    """
+
+    FUNCTIONS = ("sum", "mean", "median", "max")
+
+    def __init__(self, keys, sort=True):
+        """
+        Args:
+            keys: key for each row of the expression matrix (list, array or pd.Series)
+            sort: if True the groups are sorted, otherwise they are in the order of appearance
+        """
+        codes, groups = pd.factorize(pd.Series(keys, dtype=object), sort=sort)
+        self.codes = codes
+        self.groups = pd.Index(groups)
+        self.n_rows = len(codes)
+        valid = np.flatnonzero(codes >= 0)
+        self.indicator = sp.csr_matrix((np.ones(len(valid), dtype=np.float32), (codes[valid], valid)),
+                                       shape=(len(groups), self.n_rows))
+        self.counts = np.bincount(codes[valid], minlength=len(groups))
+        # rows sorted by group; the rows of group i are order[starts[i]:starts[i] + counts[i]]
+        self.order = valid[np.argsort(codes[valid], kind="mergesort")]
+        self.starts = np.concatenate([[0], np.cumsum(self.counts)[:-1]])
+
+    def _sum(self, exprs):
+        return np.asarray(self.indicator.dot(exprs))
+
+    def _mean(self, exprs):
+        return self._sum(exprs) / self.counts[:, np.newaxis].astype(exprs.dtype)
+
+    def _max(self, exprs):
+        return np.maximum.reduceat(exprs[self.order], self.starts, axis=0)
+
+    def _median(self, exprs):
+        out = np.empty((len(self.groups), exprs.shape[1]), dtype=exprs.dtype)
+        # groups of the same size are reduced together
+        for size in np.unique(self.counts):
+            groups = np.flatnonzero(self.counts == size)
+            rows = self.order[self.starts[groups][:, np.newaxis] + np.arange(size)]
+            out[groups] = np.median(exprs[rows], axis=1)
+        return out
+
+    def aggregate(self, exprs, fun="sum", chunk_size=None):
+        """
+        Collapse the rows of `exprs`.
+
+        Args:
+            exprs: matrix (rows x samples), may be a numpy memmap
+            fun: one of 'sum', 'mean', 'median', 'max'
+            chunk_size: number of samples (columns) to process at once. If the input is
+                memory-mapped only this many columns are held in memory.
+
+        Returns:
+            np.array (groups x samples), the rows are in the order of `self.groups`
+        """
+        assert fun in self.FUNCTIONS, "unknown aggregate function: {}".format(fun)
+        assert exprs.shape[0] == self.n_rows, "number of rows does not match the number of keys"
+        reduce_fun = getattr(self, "_" + fun)
+        if chunk_size is None:
+            return reduce_fun(np.asarray(exprs))
+        out = np.empty((len(self.groups), exprs.shape[1]), dtype=exprs.dtype)
+        for start in range(0, exprs.shape[1], chunk_size):
+            columns = slice(start, start + chunk_size)
+            out[:, columns] = reduce_fun(np.asarray(exprs[:, columns]))
+        return out
+
+    def aggregate_chunks(self, chunks, fun="sum"):
+        """
+        Collapse an expression matrix that is streamed in row chunks (see `pyfantom.osc.iter_osc_chunks`).
+
+        Median is not supported, as the rows of a group may be spread over multiple chunks.
+
+        Args:
+            chunks: iterable of matrices (rows x samples), in the order of the keys
+            fun: one of 'sum', 'mean', 'max'
+
+        Returns:
+            np.array (groups x samples)
+        """
+        assert fun in ("sum", "mean", "max"), "aggregate function not supported on row chunks: {}".format(fun)
+        indicator = self.indicator.tocsc()
+        out = None
+        row = 0
+        for chunk in chunks:
+            rows = slice(row, row + chunk.shape[0])
+            row += chunk.shape[0]
+            if out is None:
+                out = np.full((len(self.groups), chunk.shape[1]), 0 if fun != "max" else -np.inf, dtype=chunk.dtype)
+            if fun == "max":
+                codes = self.codes[rows]
+                valid = codes >= 0
+                np.maximum.at(out, codes[valid], chunk[valid])
+            else:
+                out += np.asarray(indicator[:, rows].dot(chunk))
+        assert row == self.n_rows, "number of rows does not match the number of keys"
+        if fun == "mean":
+            out /= self.counts[:, np.newaxis].astype(out.dtype)
+        return out
+
+
+def collapse_matrix(exprs, keys, fun="sum", chunk_size=None):
+    """
+    Collapse the rows of an expression matrix by a key.
+
+    Replacement for `pygenesig.tools.collapse_matrix(exprs, keys, axis=0, aggregate_fun=np.sum)`.
+
+    Args:
+        exprs: matrix (rows x samples)
+        keys: group of each row
+        fun: one of 'sum', 'mean', 'median', 'max'
+        chunk_size: number of samples to process at once
+
+    Returns:
+        pd.DataFrame (groups x samples) indexed by the (sorted) keys.
+
+    >>> collapse_matrix(np.array([[1., 2.], [3., 4.], [5., 6.]]), ["b", "a", "b"])
+         0    1
+    a  3.0  4.0
+    b  6.0  8.0
+    """
+    agg = Aggregator(keys)
+    return pd.DataFrame(agg.aggregate(exprs, fun, chunk_size), index=agg.groups)
+
+
+def merge_replicates(exprs, pdata, group_key="obo_id", replicate_col="tech_rep", fun="median", chunk_size=None):
+    """
+    Merge replicate samples (columns) of an expression matrix.
+
+    Port of `mergeSamples` from R/eset_analysis_tools.R, applied to all groups at once:
+    The samples of a group are replaced by a single sample holding the row-wise median
+    (or mean) at the position of the first sample of the group. The annotation of the first
+    sample is kept. With the defaults, this merges the technical replicates like R/analyse_f5.Rmd.
+
+    Args:
+        exprs: matrix (features x samples), may be a numpy memmap
+        pdata: sample annotation, e.g. from column_vars.processed.csv. One row per column of exprs.
+        group_key: column (or list of columns) of pdata identifying the samples to merge
+        replicate_col: only groups containing a sample where this column (e.g. tech_rep, biol_rep) is
+            True are merged. If None, all groups are merged.
+        fun: 'median' or 'mean'
+        chunk_size: number of features (rows) to process at once
+
+    Returns:
+        exprs, pdata: merged expression matrix and the corresponding annotation
+
+    >>> pdata = pd.read_csv("test/testdata/dummy.osc.pdata.csv", index_col=0)
+    >>> exprs = np.arange(14, dtype=np.float32).reshape(2, 7)
+    >>> exprs_m, pdata_m = merge_replicates(exprs, pdata)
+    >>> exprs_m
+    array([[ 0. ,  1. ,  2.5,  4. ,  5. ,  6. ],
+           [ 7. ,  8. ,  9.5, 11. , 12. , 13. ]], dtype=float32)
+    >>> list(pdata_m.lib_id)
+    ['CNhs11051', 'CNhs11969', 'CNhs12588', 'CNhs10608', 'CNhs13445', 'CNhs14463']
+    """
+    assert fun in ("median", "mean"), "unknown aggregate function: {}".format(fun)
+    assert exprs.shape[1] == len(pdata), "number of columns does not match the annotation"
+    keys = pdata[group_key].astype(str).apply("\t".join, axis=1) if isinstance(group_key, list) \
+        else pdata[group_key].astype(object)
+    # samples that are not merged get a unique key
+    singletons = pd.Series(["__sample_{}".format(i) for i in range(len(keys))], index=keys.index)
+    keys = keys.where(keys.notnull(), singletons)
+    if replicate_col is not None:
+        is_replicate = pdata[replicate_col].fillna(False).astype(bool)
+        keys = keys.where(keys.isin(set(keys[is_replicate])), singletons)
+    agg = Aggregator(keys.values, sort=False)
+    first = agg.order[agg.starts]
+
+    out = np.empty((exprs.shape[0], len(agg.groups)), dtype=exprs.dtype)
+    chunk_size = exprs.shape[0] if chunk_size is None else chunk_size
+    for start in range(0, exprs.shape[0], chunk_size):
+        rows = slice(start, start + chunk_size)
+        out[rows, :] = agg.aggregate(np.asarray(exprs[rows, :]).T, fun).T
+    return out, pdata.iloc[first]
@@ -0,0 +1,175 @@
+"""
+Annotate the FANTOM5 samples from the column headers, the ontology and the supplementary table S1.
+
+This runs the `process_sample_name` -> `process_sample_ontology` -> `merge_sample_info` chain
+from notebook 01 for all samples on a process pool.
+
+Usage:
+    python -m pyfantom.annotate_samples --header ../data/column_vars.txt \
+        --obo ../data/ff-phase2-140729.obo --si ../data/fantom5-S1.xlsx --out-dir ../data
+"""
+
+import argparse
+import logging
+import os
+import pickle
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import pandas as pd
+
+from pyfantom.ontology_cache import load_ontology, DEFAULT_CACHE_DIR
+from pyfantom.osc import read_column_variables, get_sample_infos
+from pyfantom.parse_ontology import get_lib_id, get_obo_id, process_sample_names, process_sample_ontology, \
+    merge_sample_info
+
+# ontology of the worker process, loaded from the snapshot by _init_worker
+_WORKER_OBO = None
+
+
+@contextmanager
+def timed(stage, file=sys.stdout):
+    """Print the wall time of a pipeline stage."""
+    start = time.time()
+    yield
+    print("{}: {:.2f}s".format(stage, time.time() - start), file=file)
+
+
+def read_sample_infos(filename):
+    """
+    Read the sample descriptions either from an OSC table (##ColumnVariables header)
+    or from a text file with one description per line (column_vars.txt).
+
+    >>> read_sample_infos("test/testdata/dummy.osc.txt")[-1]
+    'tpm of ARPE-19 EMT induced with TGF-beta and TNF-alpha, 00hr00min, biol_rep1.CNhs14463.13625-146H7'
+    >>> len(read_sample_infos("test/testdata/column_vars.txt"))
+    1829
+    """
+    with open(filename) as f:
+        first_line = f.readline()
+        f.seek(0)
+        if first_line.startswith("#"):
+            return get_sample_infos(read_column_variables(f))
+        return [line.rstrip("\n") for line in f if line.strip()]
+
+
+def read_supplementary_table(filename, sheet=1):
+    """
+    Read the sample types from the supplementary table S1 of the FANTOM5 publication.
+
+    Args:
+        filename: excel file (the original table) or csv/tsv export
+        sheet: sheet to read from the excel file
+
+    Returns:
+        pd.Series library id -> sample type
+    """
+    if filename.endswith((".xls", ".xlsx")):
+        si_table = pd.read_excel(filename, sheet_name=sheet)
+    else:
+        si_table = pd.read_csv(filename, sep="\t" if filename.endswith(".tsv") else ",")
+    return si_table.set_index("Library_id")["Sample type"]
+
+
+def get_sample_si(sample_info, si_types):
+    """Get the information for a sample from the supplementary table"""
+    info_si = {
+        "lib_id": get_lib_id(sample_info),
+        "obo_id": get_obo_id(sample_info),
+    }
+    info_si["sample_type"] = si_types.get(info_si["lib_id"], None) if si_types is not None else None
+    return info_si
+
+
+def _init_worker(snapshot_file):
+    global _WORKER_OBO
+    with open(snapshot_file, 'rb') as f:
+        _WORKER_OBO = pickle.load(f)
+
+
+def _annotate_chunk(chunk):
+    """
+    Annotate a chunk of samples in a worker process.
+
+    Args:
+        chunk: list of (sample_info, info_si) tuples
+
+    Returns:
+        annotations, annot_notes
+    """
+    sample_infos = [sample_info for sample_info, _ in chunk]
+    infos_n = process_sample_names(sample_infos).to_dict("records")
+    annotations = []
+    annot_notes = []
+    for info_n, (sample_info, info_si) in zip(infos_n, chunk):
+        info_o = process_sample_ontology(_WORKER_OBO, sample_info)
+        annotations.append(merge_sample_info(info_n, info_o, info_si, annot_notes))
+    return annotations, annot_notes
+
+
+def annotate_samples(sample_infos, snapshot_file, si_types=None, n_jobs=None, chunk_size=100):
+    """
+    Annotate all samples on a process pool.
+
+    Args:
+        sample_infos: list of sample descriptions (column headers)
+        snapshot_file: pickled OBOOntology or OntologyIndex that is loaded by every worker
+        si_types: pd.Series library id -> sample type from the supplementary table
+        n_jobs: number of worker processes (default: number of cpus)
+        chunk_size: number of samples per task
+
+    Returns:
+        annotations_df, annot_notes_df
+    """
+    tasks = [sample_infos[i:i + chunk_size] for i in range(0, len(sample_infos), chunk_size)]
+    tasks = [[(sample_info, get_sample_si(sample_info, si_types)) for sample_info in task] for task in tasks]
+    annotations = []
+    annot_notes = []
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(snapshot_file,)) as pool:
+        for chunk_annotations, chunk_notes in pool.map(_annotate_chunk, tasks):
+            annotations.extend(chunk_annotations)
+            annot_notes.extend(chunk_notes)
+    annotations_df = pd.DataFrame(annotations)
+    annotations_df = annotations_df[sorted(annotations_df.columns)]
+    annot_notes_df = pd.DataFrame(annot_notes, columns=["lib_id", "obo_id", "field_name", "new_value"])
+    return annotations_df, annot_notes_df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="annotate-samples", description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--header", required=True,
+                        help="OSC table or column_vars.txt with one sample description per line")
+    parser.add_argument("--obo", required=True, help="FANTOM5 ontology (obo file)")
+    parser.add_argument("--si", help="supplementary table S1 (xlsx or csv/tsv)")
+    parser.add_argument("--si-sheet", type=int, default=1, help="sheet of the supplementary table")
+    parser.add_argument("--out-dir", default=".", help="output directory")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="directory of the ontology snapshots")
+    parser.add_argument("--jobs", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--chunk-size", type=int, default=100, help="number of samples per task")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    with timed("read sample descriptions"):
+        sample_infos = read_sample_infos(args.header)
+    with timed("read supplementary table"):
+        si_types = read_supplementary_table(args.si, args.si_sheet) if args.si is not None else None
+    with timed("load ontology"):
+        obo = load_ontology(args.obo, args.cache_dir)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        snapshot_file = os.path.join(tmp_dir, "ontology.pickle")
+        with timed("write ontology snapshot"):
+            with open(snapshot_file, 'wb') as f:
+                pickle.dump(obo, f, protocol=pickle.HIGHEST_PROTOCOL)
+        with timed("annotate {} samples".format(len(sample_infos))):
+            annotations_df, annot_notes_df = annotate_samples(sample_infos, snapshot_file, si_types,
+                                                              n_jobs=args.jobs, chunk_size=args.chunk_size)
+    with timed("write results"):
+        annotations_df.to_csv(os.path.join(args.out_dir, "column_vars.processed.csv"))
+        annot_notes_df.to_csv(os.path.join(args.out_dir, "annotation_notes.csv"))
+
+
+if __name__ == "__main__":
+    main()
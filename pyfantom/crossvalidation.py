@@ -0,0 +1,135 @@
+"""
+Cross-validation of signatures on a process pool.
+
+Port of the fold loop of notebook 08: for every fold, signatures are generated on the
+training samples and the test samples are classified by the signature with the highest
+score (`pyfantom.scoring.SignatureScorer`).
+
+    * The folds are split by group (e.g. the obo id), such that the replicates of a sample
+      are never split between training and test set.
+    * The folds run on a process pool. Every worker opens the expression matrix (.npy file)
+      as a read-only memory map, so the matrix is neither pickled nor copied.
+    * The confusion matrices are summed up as the folds finish.
+
+Usage:
+    confusion, folds = cross_validate("../data/pygenesig/by_promotor/primary_exprs.npy", target,
+                                      col_vars.obo_id, gini_signatures, n_splits=10,
+                                      signature_kwargs={'min_gini': .8, 'max_rk': 3, 'min_expr': 5})
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from pyfantom.scoring import SignatureScorer
+
+# expression matrix of the worker process, memory-mapped by _init_worker
+_WORKER_EXPRS = None
+
+
+def group_folds(target, groups, n_splits, seed=None):
+    """
+    Assign samples to folds, keeping the samples of a group together.
+
+    The groups of every class are shuffled and distributed round-robin over the folds,
+    such that each class is spread evenly over the folds (like StratifiedKFold, but on groups).
+
+    Args:
+        target: class label of every sample
+        groups: group of every sample, e.g. the obo id. All samples of a group must have the same label.
+        n_splits: number of folds
+        seed: seed for shuffling the groups
+
+    Returns:
+        np.array with the fold of every sample
+
+    >>> target = ["a", "a", "a", "a", "b", "b"]
+    >>> groups = ["x", "x", "y", "z", "u", "v"]
+    >>> folds = group_folds(target, groups, 2, seed=0)
+    >>> bool(folds[0] == folds[1]), sorted(np.bincount(folds[4:]).tolist())
+    (True, [1, 1])
+    """
+    df = pd.DataFrame({"target": np.asarray(target), "group": np.asarray(groups)})
+    group_target = df.drop_duplicates().set_index("group").target
+    assert group_target.index.is_unique, "all samples of a group must have the same label"
+    rng = np.random.RandomState(seed)
+    group_fold = dict()
+    offset = 0
+    for _, class_groups in group_target.groupby(group_target):
+        class_groups = list(class_groups.index)
+        rng.shuffle(class_groups)
+        for i, group in enumerate(class_groups):
+            group_fold[group] = (offset + i) % n_splits
+        # start the next class where this one stopped to balance the fold sizes
+        offset += len(class_groups)
+    return df.group.map(group_fold).values
+
+
+def _init_worker(exprs_file):
+    global _WORKER_EXPRS
+    _WORKER_EXPRS = np.load(exprs_file, mmap_mode='r')
+
+
+def _run_fold(fold, train, test, target, labels, signature_fun, signature_kwargs):
+    """
+    Generate the signatures on the training samples and classify the test samples.
+
+    Returns:
+        fold, confusion matrix (true label x predicted label), signatures
+    """
+    exprs = _WORKER_EXPRS
+    signatures = signature_fun(np.asarray(exprs[:, train]), target[train], **signature_kwargs)
+    confusion = np.zeros((len(labels), len(labels)), dtype=np.int64)
+    signatures = dict((label, rows) for label, rows in signatures.items() if len(rows) > 0)
+    if signatures:
+        scorer = SignatureScorer(range(exprs.shape[0]), signatures)
+        scores = scorer.score(exprs[:, test], n_jobs=1)
+        predicted = scores.index[np.argmax(scores.values, axis=0)]
+        label_index = dict((label, i) for i, label in enumerate(labels))
+        np.add.at(confusion, ([label_index[x] for x in target[test]], [label_index[x] for x in predicted]), 1)
+    return fold, confusion, signatures
+
+
+def cross_validate(exprs_file, target, groups, signature_fun, n_splits=10, signature_kwargs=None,
+                   n_jobs=None, seed=None, callback=None):
+    """
+    Cross-validate signatures with folds split by group.
+
+    Args:
+        exprs_file: .npy file with the expression matrix (genes x samples), e.g. primary_exprs.npy
+        target: class label of every sample, e.g. primary_target_coarse.csv
+        groups: group of every sample, e.g. col_vars.obo_id
+        signature_fun: function (exprs, target, **signature_kwargs) -> dict label -> list of gene (row)
+            indices. It is run in the worker processes and needs to be picklable (defined at module level).
+        n_splits: number of folds
+        signature_kwargs: keyword arguments for signature_fun, e.g. {'min_gini': .8, 'max_rk': 3}
+        n_jobs: number of worker processes (default: number of cpus)
+        seed: seed for the assignment of groups to folds
+        callback: called with (fold, confusion) whenever a fold finishes
+
+    Returns:
+        confusion, folds:
+            confusion: pd.DataFrame (true label x predicted label), sum over all folds
+            folds: list of dicts with fold, confusion and signatures of every fold, ordered by fold
+    """
+    target = np.asarray(target)
+    labels = sorted(set(target))
+    folds = group_folds(target, groups, n_splits, seed)
+    exprs_shape = np.load(exprs_file, mmap_mode='r').shape
+    assert exprs_shape[1] == len(target), "number of samples does not match the target"
+    signature_kwargs = signature_kwargs if signature_kwargs is not None else dict()
+    confusion = np.zeros((len(labels), len(labels)), dtype=np.int64)
+    results = []
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(exprs_file,)) as pool:
+        futures = [pool.submit(_run_fold, fold, np.flatnonzero(folds != fold), np.flatnonzero(folds == fold),
+                               target, labels, signature_fun, signature_kwargs) for fold in range(n_splits)]
+        for future in as_completed(futures):
+            fold, fold_confusion, signatures = future.result()
+            confusion += fold_confusion
+            results.append({"fold": fold, "confusion": pd.DataFrame(fold_confusion, index=labels, columns=labels),
+                            "signatures": signatures})
+            if callback is not None:
+                callback(fold, results[-1]["confusion"])
+    results.sort(key=lambda result: result["fold"])
+    return pd.DataFrame(confusion, index=labels, columns=labels), results
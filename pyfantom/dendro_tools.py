@@ -1,7 +1,12 @@
 import numpy as np
 import pandas as pd
 from plotly.tools import FigureFactory as FF
+from scipy.cluster.hierarchy import to_tree
+from scipy.stats import hypergeom
 from collections import Counter
+import itertools
+import scipy.sparse as sp
+from pyfantom.ontology_index import OntologyIndex, super_term_ids
 
 
 class DendrogramNode:
@@ -34,6 +39,11 @@ class DendrogramTree:
     right to the bottom right end respectively. Parent refers to the top middle.
     Coordinates are rounded to avoid numerical problems.
     The Coordinates are relative to the matplotlib cooridnate system used to generate the dendrogram.
+
+    Alternatively, the tree can be built from a linkage matrix with `from_linkage`.
+    Nodes are then identified by the ids of `scipy.cluster.hierarchy.to_tree`
+    (leafs 0..n-1, inner nodes n..2n-2) and the plotly coordinates are only computed
+    on request with `get_plotly_coords`.
     """
 
     def __init__(self, plotly_dendro, corr_mat_df):
@@ -46,17 +56,83 @@ class DendrogramTree:
 
         >>> np.random.seed(42)
         >>> corr_mat_df = pd.DataFrame(np.random.random((10, 10)))
-        >>> dendro = FF.create_dendrogram(corr_mat_df.as_matrix())
+        >>> dendro = FF.create_dendrogram(corr_mat_df.values)
         >>> dt = DendrogramTree(dendro, corr_mat_df)
 
         """
         self.ref_dict = dict()
         self.dendro = plotly_dendro
         self.corr_mat_df = corr_mat_df
+        self.linkage = None
+        self.labels = None
+        self.super_term_counts = None
         for data_item in self.dendro['data']:
             self.add_item(data_item)
+        self.index_tree()
         self.check_consistency()
 
+    @classmethod
+    def from_linkage(cls, Z, labels):
+        """
+        Construct a Tree from a linkage matrix, without generating a plotly dendrogram.
+
+        Args:
+            Z: linkage matrix, e.g. from `scipy.cluster.hierarchy.linkage`
+            labels: obo id of each leaf, in the order of the observations Z was computed from
+
+        >>> from scipy.cluster.hierarchy import linkage
+        >>> np.random.seed(42)
+        >>> Z = linkage(np.random.random((10, 10)))
+        >>> dt = DendrogramTree.from_linkage(Z, list("ABCDEFGHIJ"))
+        >>> dt.root, dt.n_leafs(dt.root), [dt.leaf_to_obo(leaf) for leaf in dt.get_leaf_nodes(dt.root)][:3]
+        (18, 10, ['F', 'G', 'J'])
+        >>> dt.get_plotly_coords()[5], dt.get_plotly_coords()[dt.find_parent(5)]
+        ((5.0, 0.0), (25.3125, 1.1716))
+        """
+        tree = cls.__new__(cls)
+        tree.ref_dict = dict()
+        tree.dendro = None
+        tree.corr_mat_df = None
+        tree.linkage = np.asarray(Z)
+        tree.labels = list(labels)
+        tree.super_term_counts = None
+        assert len(tree.labels) == tree.linkage.shape[0] + 1, "number of labels does not match the linkage matrix"
+        _, nodes = to_tree(tree.linkage, rd=True)
+        for node in nodes:
+            if not node.is_leaf():
+                tree.ref_dict[node.id] = DendrogramNode(None, left=node.get_left().id, right=node.get_right().id)
+        tree.index_tree()
+        tree.check_consistency()
+        return tree
+
+    def get_plotly_coords(self):
+        """
+        Get the mapping from node ids to the (rounded) coordinates of the plotly dendrogram.
+
+        For trees built from a plotly dendrogram, the nodes are already identified by the coordinates.
+        For trees built from a linkage matrix, the coordinates are computed (once) like in
+        `FF.create_dendrogram`: the leafs are placed at x = 5, 15, 25, ... and the
+        inner nodes at the center of their children at the height of the merge.
+        """
+        if self.linkage is None:
+            return {coords: coords for coords in itertools.chain(self.ref_dict, self.leafs)}
+        if getattr(self, "_plotly_coords", None) is None:
+            x = dict((leaf, 5.0 + 10 * i) for i, leaf in enumerate(self.leafs))
+            coords = dict((leaf, (x[leaf], 0.0)) for leaf in self.leafs)
+            n_leafs = len(self.labels)
+            for i, (left, right, dist, _) in enumerate(self.linkage):  # children are merged before parents
+                node_id = n_leafs + i
+                x[node_id] = np.mean(self.rnd((x[int(left)], x[int(right)]), 6))
+                coords[node_id] = self.rnd((x[node_id], dist))
+            self._plotly_coords = coords
+        return self._plotly_coords
+
+    def is_leaf(self, node):
+        """Return True if node is a leaf of the tree"""
+        if self.labels is not None:
+            return node < len(self.labels)
+        return node[1] == 0  # y == 0 -> leaf
+
     @staticmethod
     def get_test_tree():
         """Setup a (seeded) random dendrogram tree for doctests"""
@@ -64,7 +140,7 @@ class DendrogramTree:
         names = list("ABCDEFGHIJ")
         corr_mat_df = pd.DataFrame(np.random.random((10, 10)),
                                    columns=names, index=names)
-        dendro = FF.create_dendrogram(corr_mat_df.as_matrix())
+        dendro = FF.create_dendrogram(corr_mat_df.values)
         return DendrogramTree(dendro, corr_mat_df)
 
     @staticmethod
@@ -87,8 +163,10 @@ class DendrogramTree:
 
     def leaf_to_obo(self, leaf_coords):
         """
-        Turn coordinates of a leaf into the respective obo id.
+        Turn coordinates (or the node id) of a leaf into the respective obo id.
         """
+        if self.labels is not None:
+            return self.labels[leaf_coords]
         layout = self.dendro['layout']['xaxis']
         i = layout['tickvals'].index(leaf_coords[0])
         leaf_id = int(layout['ticktext'][i])
@@ -103,57 +181,155 @@ class DendrogramTree:
         self.ref_dict[coords] = DendrogramNode(coords, left=self.get_left_coordinate(data_item),
                                                right=self.get_right_coordinate(data_item))
 
+    def index_tree(self):
+        """
+        Store parent pointers and the leaf order of the tree.
+
+        The leafs are numbered from left to right, such that the leafs below
+        each node are a contiguous range `leaf_range[coords] = (start, stop)` of `self.leafs`.
+        The tree is traversed iteratively, i.e. this is linear in the number of nodes.
+        """
+        self.parent_dict = dict()
+        for coords, node in self.ref_dict.items():
+            for child in (node.left, node.right):
+                assert child not in self.parent_dict, "node has multiple parents: {}".format(child)
+                self.parent_dict[child] = coords
+        roots = [coords for coords in self.ref_dict if coords not in self.parent_dict]
+        assert len(roots) == 1, "tree has {} roots".format(len(roots))
+        self.root = roots[0]
+
+        self.leafs = []
+        self.leaf_range = dict()
+        start = dict()
+        stack = [(self.root, False)]
+        while stack:
+            coords, visited = stack.pop()
+            if self.is_leaf(coords):
+                self.leaf_range[coords] = (len(self.leafs), len(self.leafs) + 1)
+                self.leafs.append(coords)
+            elif not visited:
+                start[coords] = len(self.leafs)
+                stack.append((coords, True))
+                stack.append((self.ref_dict[coords].right, False))
+                stack.append((self.ref_dict[coords].left, False))
+            else:
+                self.leaf_range[coords] = (start[coords], len(self.leafs))
+
     def get_leaf_nodes(self, coords):
         """
-        Get all leafs_ids (index in the array generating the dendrogram) by
-        recursing through the ref_dict containing parent/child relations of
-        the dendrogram elements.
+        Get all leafs_ids (index in the array generating the dendrogram)
+        below a node, from left to right.
 
         >>> dt = DendrogramTree.get_test_tree()
         >>> [x for x in dt.get_leaf_nodes((13.75, 1.4248))]
         [(5.0, 0.0), (15.0, 0.0), (25.0, 0.0), (35.0, 0.0)]
         """
-        if coords[1] == 0:  # y == 0 -> leaf
-            yield coords
-        else:
-            yield from self.get_leaf_nodes(self.ref_dict[coords].left)
-            yield from self.get_leaf_nodes(self.ref_dict[coords].right)
+        start, stop = self.leaf_range[coords]
+        return iter(self.leafs[start:stop])
+
+    def n_leafs(self, coords):
+        """
+        Number of leafs below a node
+
+        >>> dt = DendrogramTree.get_test_tree()
+        >>> dt.n_leafs((13.75, 1.4248)), dt.n_leafs(dt.root)
+        (4, 10)
+        """
+        start, stop = self.leaf_range[coords]
+        return stop - start
 
     def find_parent(self, coords):
         """
         Get parent coordinate of a given coordinate in the dendrogram.
-        Note: this method is ugly and inefficient.
+        Returns None for the root.
 
         >>> dt = DendrogramTree.get_test_tree()
         >>> dt.find_parent((5.0, 0.0))
         (13.75, 1.4248)
         """
-        for parent_coords, child_coords in self.ref_dict.items():
-            if coords in [child_coords.left, child_coords.right]:
-                return parent_coords
-        if coords[1] == max(x[1] for x in self.ref_dict):  # root
+        if coords == self.root:
             return None
-        else:
+        try:
+            return self.parent_dict[coords]
+        except KeyError:
             raise Exception("parent not found. ")
 
     def retrieve_super_terms(self, obo, delimiter_nodes):
         """
-        Compute super terms for all nodes in the tree with respect to obo. (slow)
+        Compute super terms for all nodes in the tree with respect to obo.
+
+        The super terms of every leaf are retrieved from the ontology once. The counts
+        of an inner node are the sum of the counts of its two children, computed in a single
+        bottom-up pass. The result is stored as a sparse (nodes x terms) matrix in
+        `self.super_term_counts`, with rows `self.node_ids` and columns `self.term_ids`.
 
         Args:
-            obo: OBOOntology
+            obo: OBOOntology or OntologyIndex
             delimiter_nodes: stopping criterion for the ontology; any terms closer
                 to the root than these terms will not be considered.
+
+        >>> from pyfantom.obo import OBOOntology
+        >>> from scipy.cluster.hierarchy import linkage
+        >>> obo = OBOOntology()
+        >>> obo.load(open("test/testdata/ff-phase2-140729.obo"))
+        >>> np.random.seed(42)
+        >>> samples = ["FF:11376-118A8", "FF:11327-117E4", "FF:10000-101A1", "FF:10301-104H4"]
+        >>> dt = DendrogramTree.from_linkage(linkage(np.random.random((4, 4))), samples)
+        >>> dt.retrieve_super_terms(obo, delimiter_nodes=["FF:0000001"])
+        >>> dt.super_term_counts.shape[0], dt.get_super_terms(dt.root)["FF:0000004"]
+        (3, 2)
         """
-        for coords in self.ref_dict:
-            for leaf in self.get_leaf_nodes(coords):
-                obo_id = self.leaf_to_obo(leaf)
-                for term in obo.super_terms(obo_id):
-                    if term.id not in delimiter_nodes:
-                        self[coords].add_super_term(term.id)
+        delimiter_nodes = set(delimiter_nodes)
+        if isinstance(obo, OntologyIndex):
+            self.term_ids = obo.term_ids
+            is_delimiter = np.zeros(len(obo), dtype=bool)
+            is_delimiter[[obo.index(term_id) for term_id in delimiter_nodes if term_id in obo]] = True
+
+            def leaf_terms(obo_id):
+                i = obo.index(obo_id)
+                terms = obo.ancestor_indices[obo.ancestor_indptr[i]:obo.ancestor_indptr[i + 1]]
+                return terms[~is_delimiter[terms]]
+        else:
+            self.term_ids = []
+            term_index = dict()
+
+            def leaf_terms(obo_id):
+                terms = []
+                for term_id in super_term_ids(obo, obo_id):
+                    if term_id not in delimiter_nodes:
+                        if term_id not in term_index:
+                            term_index[term_id] = len(self.term_ids)
+                            self.term_ids.append(term_id)
+                        terms.append(term_index[term_id])
+                return np.unique(np.array(terms, dtype=np.int32))
+
+        # sparse count vectors (term indices, counts) of every node
+        counts = dict()
+        for leaf in self.leafs:
+            terms = leaf_terms(self.leaf_to_obo(leaf))
+            counts[leaf] = (terms, np.ones(len(terms), dtype=np.int32))
+        # children have less leafs than their parents -> they are processed first
+        self.node_ids = sorted(self.ref_dict, key=self.n_leafs)
+        for node in self.node_ids:
+            left_terms, left_counts = counts[self[node].left]
+            right_terms, right_counts = counts[self[node].right]
+            terms, inverse = np.unique(np.concatenate([left_terms, right_terms]), return_inverse=True)
+            counts[node] = (terms, np.bincount(inverse, weights=np.concatenate([left_counts, right_counts]))
+                            .astype(np.int32))
+
+        rows = [counts[node] for node in self.node_ids]
+        indptr = np.concatenate([[0], np.cumsum([len(terms) for terms, _ in rows])])
+        self.super_term_counts = sp.csr_matrix(
+            (np.concatenate([c for _, c in rows]), np.concatenate([t for t, _ in rows]), indptr),
+            shape=(len(self.node_ids), len(self.term_ids)))
+        self.node_row = dict((node, i) for i, node in enumerate(self.node_ids))
 
     def get_super_terms(self, coords):
-        return self.ref_dict[coords].super_terms
+        """Get a Counter term id -> number of leafs below the node that are a sub term of that term"""
+        if getattr(self, "super_term_counts", None) is None:
+            return self.ref_dict[coords].super_terms
+        row = self.super_term_counts.getrow(self.node_row[coords])
+        return Counter(dict((self.term_ids[j], int(c)) for j, c in zip(row.indices, row.data)))
 
     def get_filtered_super_terms(self, coords):
         """remove super terms with ratio 1.0 in that parent node, as these lead to no infomration gain. """
@@ -161,24 +337,109 @@ class DendrogramTree:
         parent_coords = self.find_parent(coords)
         if parent_coords is not None:
             parent_super_terms = self.get_super_terms(parent_coords)
-            n_leafs = sum(1 for _ in self.get_leaf_nodes(parent_coords))
+            n_leafs = self.n_leafs(parent_coords)
             # collate list of parent super terms that match all children:
             parent_super_terms = [term for term, count in parent_super_terms.items() if count == n_leafs]
             super_terms = {term: count for term, count in super_terms.items() if term not in parent_super_terms}
         return super_terms
 
+    def term_enrichment(self, counts=None, background=None, n_background=None):
+        """
+        Test all nodes for enrichment of all ontology terms at once.
+
+        For every node and term, the p-value is the probability of observing at least `count`
+        of the `n_leafs` leafs of the node under the term, when drawing without replacement
+        from `n_background` samples of which `background` are under the term (one-sided
+        hypergeometric / Fisher's exact test). The p-values are corrected with Benjamini-Hochberg
+        within each node. Only (node, term) pairs with a non-zero count are reported, the
+        p-value of all other pairs is 1.
+
+        Args:
+            counts: sparse (nodes x terms) matrix, defaults to `self.super_term_counts`
+                (see `retrieve_super_terms`). Rows and columns correspond to `self.node_ids`
+                and `self.term_ids`.
+            background: number of background samples under each term, either an array aligned with
+                the columns of `counts` or a dict/pd.Series term id -> count (like `super_term_count`
+                in notebook 05). Defaults to the counts of the root, i.e. the leafs of the tree are the background.
+            n_background: total number of background samples, defaults to the number of leafs.
+
+        Returns:
+            pd.DataFrame with the columns node, term_id, count, n_leafs, background, fold_change, pvalue, fdr
+
+        >>> from pyfantom.obo import OBOOntology
+        >>> from scipy.cluster.hierarchy import linkage
+        >>> obo = OBOOntology()
+        >>> obo.load(open("test/testdata/ff-phase2-140729.obo"))
+        >>> samples = ["FF:11376-118A8", "FF:11327-117E4", "FF:10000-101A1", "FF:10301-104H4"]
+        >>> Z = linkage(np.array([[0.], [0.1], [1.], [1.2]]))
+        >>> dt = DendrogramTree.from_linkage(Z, samples)
+        >>> dt.retrieve_super_terms(obo, delimiter_nodes=["FF:0000001"])
+        >>> enrichment = dt.term_enrichment()
+        >>> columns = ["node", "count", "n_leafs", "fold_change", "pvalue"]
+        >>> print(enrichment[enrichment.term_id == "CL:0000136"][columns].to_string(index=False))
+         node  count  n_leafs  fold_change   pvalue
+            4      2        2          2.0 0.166667
+            6      2        4          1.0 1.000000
+        """
+        if counts is None:
+            counts = self.super_term_counts
+        assert counts is not None, "no counts given, call retrieve_super_terms first"
+        counts = sp.csr_matrix(counts)
+        if background is None:
+            background = counts.getrow(self.node_ids.index(self.root)).toarray().ravel()
+        elif isinstance(background, (dict, pd.Series)):
+            background = pd.Series(background).reindex(self.term_ids).fillna(0).values
+        background = np.asarray(background, dtype=np.int64)
+        if n_background is None:
+            n_background = len(self.leafs)
+        assert len(background) == counts.shape[1], "background does not match the number of terms"
+
+        # sparse entries (node, term, count)
+        rows = np.repeat(np.arange(counts.shape[0]), np.diff(counts.indptr))
+        cols = counts.indices
+        count = counts.data.astype(np.int64)
+        n_leafs = np.array([self.n_leafs(node) for node in self.node_ids])[rows]
+        # many entries share the same (count, background, n_leafs); compute each p-value once
+        params, inverse = np.unique(np.stack([count, background[cols], n_leafs], axis=1), axis=0,
+                                    return_inverse=True)
+        pvalue = hypergeom.sf(params[:, 0] - 1, n_background, params[:, 1], params[:, 2])[inverse.ravel()]
+        fold_change = (count / n_leafs) / (background[cols] / n_background)
+
+        # Benjamini-Hochberg within each node; m = number of terms with a non-empty background
+        m = np.count_nonzero(background)
+        order = np.lexsort((pvalue, rows))
+        rank = np.arange(len(order)) - counts.indptr[rows[order]] + 1
+        fdr_sorted = pvalue[order] * m / rank
+        # cumulative minimum from the end within each node; the offset keeps nodes apart
+        offset = 2.0 * rows[order]
+        fdr_sorted = np.minimum.accumulate((fdr_sorted + offset)[::-1])[::-1] - offset
+        fdr = np.empty_like(pvalue)
+        fdr[order] = np.minimum(fdr_sorted, 1.0)
+
+        return pd.DataFrame({
+            "node": [self.node_ids[i] for i in rows],
+            "term_id": [self.term_ids[j] for j in cols],
+            "count": count,
+            "n_leafs": n_leafs,
+            "background": background[cols],
+            "fold_change": fold_change,
+            "pvalue": pvalue,
+            "fdr": fdr,
+        })
+
     def check_consistency(self):
         """check that coordinates are consistent"""
         for child_coords in self.ref_dict.values():
             left = child_coords.left
             right = child_coords.right
-            if left[1] != 0:  # leafs have no entry
+            if not self.is_leaf(left):  # leafs have no entry
                 assert left in self.ref_dict
-            if right[1] != 0:
+            if not self.is_leaf(right):
                 assert right in self.ref_dict
         for child_coords in self.ref_dict.values():
             assert self.find_parent(child_coords.left) is not None
             assert self.find_parent(child_coords.right) is not None
+        assert len(self.leafs) == len(self.ref_dict) + 1, "tree is not binary"
 
     def __getitem__(self, item):
         return self.ref_dict[item]
@@ -0,0 +1,157 @@
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from pyfantom.osc import read_osc_header, get_sample_annotation, iter_osc_chunks, STAT_ROW_REGEX
+
+EXPRS_FILE = "exprs.npy"
+FDATA_FILE = "fdata.feather"
+PDATA_FILE = "pdata.feather"
+META_FILE = "meta.json"
+
+
+class ExpressionStore:
+    """
+    Binary on-disk store of the expression matrix, created once from the OSC table with `convert_osc`.
+
+    The store is a directory with
+        * exprs.npy: float32 matrix (peaks x samples) in Fortran order, i.e.
+          the values of every sample are contiguous on disk.
+        * fdata.feather: the peak annotation (rows of exprs.npy)
+        * pdata.feather: the sample annotation (columns of exprs.npy)
+        * meta.json: the column the samples are grouped by
+
+    The matrix is memory-mapped, opening a store does not read the expression values.
+    If the store was grouped on conversion, the samples of a group are adjacent columns
+    and `get_group` returns a view of the memory map rather than a copy.
+
+    >>> import tempfile
+    >>> store_dir = tempfile.mkdtemp()
+    >>> pdata = pd.read_csv("test/testdata/dummy.osc.pdata.csv", index_col=0)
+    >>> store = convert_osc("test/testdata/dummy.osc.txt", store_dir, pdata=pdata, group_by="sample_type")
+    >>> store = ExpressionStore(store_dir)
+    >>> store.exprs.shape, store.groups()
+    ((8, 7), ['cell line', 'primary cell', 'tissue'])
+    >>> pdata_t, exprs_t = store.get_group("tissue")
+    >>> list(pdata_t.lib_id), np.shares_memory(exprs_t, store.exprs)
+    (['CNhs10608', 'CNhs13445'], True)
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.exprs = np.load(os.path.join(store_dir, EXPRS_FILE), mmap_mode='r')
+        self.fdata = pd.read_feather(os.path.join(store_dir, FDATA_FILE)).set_index(self.meta["fdata_index"])
+        self.pdata = pd.read_feather(os.path.join(store_dir, PDATA_FILE)).set_index(self.meta["pdata_index"])
+        self.group_by = self.meta["group_by"]
+
+    def groups(self):
+        """List of sample groups in the order of the columns"""
+        if self.group_by is None:
+            return []
+        return list(pd.unique(self.pdata[self.group_by]))
+
+    def group_slice(self, group):
+        """The column slice of the samples in `group`"""
+        assert self.group_by is not None, "the store is not grouped"
+        positions = np.flatnonzero((self.pdata[self.group_by] == group).values)
+        assert len(positions) > 0, "unknown group: {}".format(group)
+        return slice(positions[0], positions[-1] + 1)
+
+    def get_group(self, group):
+        """
+        Get the sample annotation and the expression values of a sample group.
+
+        Returns:
+            pdata, exprs: the expression values are a (read-only) view of the memory map
+        """
+        columns = self.group_slice(group)
+        return self.pdata.iloc[columns], self.exprs[:, columns]
+
+    def select(self, samples):
+        """
+        Get the sample annotation and the expression values for an arbitrary sample selection.
+
+        Args:
+            samples: boolean mask over pdata
+
+        Returns:
+            pdata, exprs: the expression values are copied, unless the selection is contiguous.
+        """
+        positions = np.flatnonzero(np.asarray(samples))
+        if len(positions) > 0 and positions[-1] - positions[0] + 1 == len(positions):
+            columns = slice(positions[0], positions[-1] + 1)
+            return self.pdata.iloc[columns], self.exprs[:, columns]
+        return self.pdata.iloc[positions], self.exprs[:, positions]
+
+
+def _count_data_rows(filename, n_comment_lines):
+    """Count the CAGE peaks (rows that are neither comments, column names, statistics nor blank)"""
+    stat_rows = re.compile(STAT_ROW_REGEX)
+    n_rows = 0
+    with open(filename) as f:
+        for i, line in enumerate(f):
+            if i > n_comment_lines and line.strip() and not stat_rows.match(line):
+                n_rows += 1
+    return n_rows
+
+
+def convert_osc(osc_file, store_dir, pdata=None, group_by=None, chunk_size=10000):
+    """
+    Convert an OSC table into an ExpressionStore.
+
+    The table is streamed in chunks (see `iter_osc_chunks`) and written to a memory-mapped .npy file,
+    so that memory is bounded by the chunk size.
+
+    Args:
+        osc_file: path to the OSC table
+        store_dir: output directory
+        pdata: sample annotation, one row per sample in the column order of the table
+            (e.g. column_vars.processed.csv). Defaults to the annotation parsed from the header.
+        group_by: column of pdata. The samples are stored sorted by that column
+            (stable), such that every group is a contiguous block of columns.
+        chunk_size: number of rows to process at once
+
+    Returns:
+        ExpressionStore
+    """
+    header = read_osc_header(osc_file)
+    header_annotation = get_sample_annotation(header)
+    if pdata is None:
+        pdata = header_annotation
+    assert list(pdata.lib_id) == list(header_annotation.lib_id), "pdata does not match the columns of the table"
+    if group_by is not None:
+        order = np.argsort(pdata[group_by].astype(str).values, kind="mergesort")
+    else:
+        order = np.arange(len(pdata))
+
+    os.makedirs(store_dir, exist_ok=True)
+    n_rows = _count_data_rows(osc_file, header.n_comment_lines)
+    exprs = np.lib.format.open_memmap(os.path.join(store_dir, EXPRS_FILE), mode='w+', dtype=np.float32,
+                                      shape=(n_rows, len(pdata)), fortran_order=True)
+    fdata_chunks = []
+    row = 0
+    for fdata, chunk in iter_osc_chunks(osc_file, chunk_size=chunk_size):
+        exprs[row:row + chunk.shape[0], :] = chunk[:, order]
+        row += chunk.shape[0]
+        fdata_chunks.append(fdata)
+    assert row == n_rows, "unexpected number of rows"
+    exprs.flush()
+    del exprs
+
+    fdata = pd.concat(fdata_chunks)
+    pdata = pdata.iloc[order]
+    meta = {
+        "fdata_index": fdata.index.name,
+        "pdata_index": pdata.index.name if pdata.index.name is not None else "index",
+        "group_by": group_by,
+    }
+    fdata.reset_index().to_feather(os.path.join(store_dir, FDATA_FILE))
+    pdata.rename_axis(meta["pdata_index"]).reset_index().to_feather(os.path.join(store_dir, PDATA_FILE))
+    with open(os.path.join(store_dir, META_FILE), 'w') as f:
+        json.dump(meta, f)
+    return ExpressionStore(store_dir)
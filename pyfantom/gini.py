@@ -0,0 +1,102 @@
+"""
+Gini-index based signatures, see README.md.
+
+    1. The samples of every group (tissue, cell type) are aggregated by their median (or mean),
+       resulting in a genes x groups matrix X (`pyfantom.aggregate.Aggregator`).
+    2. The gini index g of every gene (row of X).
+    3. The rank R of every group within a gene (1 = highest expression).
+    4. The relative rank of every gene within a group (0 = highest expression, i.e. 1 - quantile).
+    5. Gene i is in the signature of group j if g(i) >= min_gini, R(i, j) <= max_rk,
+       X(i, j) >= min_expr and the relative rank is <= max_rel_rk.
+
+All steps are computed for all genes and groups at once by sorting along the axes of X.
+
+Usage:
+    signatures = gini_signatures(exprs, col_vars.sample_type)
+    write_signatures_gmt(signatures, fdata.gene_symbol, "../results/primary_fine.gmt")
+"""
+
+import numpy as np
+
+from pyfantom.aggregate import Aggregator
+from pyfantom.gmt import write_gmt
+
+
+def gini(x, axis=1):
+    """
+    Gini index of non-negative values along an axis.
+
+    >>> gini(np.array([[1., 1., 1., 1.], [0., 0., 0., 4.], [0., 0., 0., 0.]]))
+    array([0.  , 0.75,  nan])
+    """
+    x = np.sort(np.asarray(x, dtype=np.float64), axis=axis)
+    n = x.shape[axis]
+    shape = [1] * x.ndim
+    shape[axis] = n
+    weights = (2 * np.arange(1, n + 1) - n - 1).reshape(shape)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.sum(weights * x, axis=axis) / (n * np.sum(x, axis=axis))
+
+
+def descending_ranks(x, axis=1):
+    """
+    Rank of the values along an axis, the highest value has rank 1. Ties are ranked in order of appearance.
+
+    >>> descending_ranks(np.array([[3., 1., 2.], [1., 1., 0.]]))
+    array([[1, 3, 2],
+           [1, 2, 3]])
+    """
+    order = np.argsort(-np.asarray(x), axis=axis, kind="stable")
+    ranks = np.empty(order.shape, dtype=np.int64)
+    shape = [1] * order.ndim
+    shape[axis] = order.shape[axis]
+    np.put_along_axis(ranks, order, np.arange(1, order.shape[axis] + 1).reshape(shape), axis=axis)
+    return ranks
+
+
+def gini_signatures(exprs, target, min_gini=.7, max_rk=3, min_expr=1, max_rel_rk=.33, aggregate_fun="median"):
+    """
+    Create gini signatures from an expression matrix.
+
+    Can be used as `signature_fun` of `pyfantom.crossvalidation.cross_validate`.
+
+    Args:
+        exprs: matrix (genes x samples), e.g. primary_exprs.npy
+        target: group of every sample, e.g. the sample_type column of column_vars.processed.csv
+        min_gini: minimal gini index of a gene
+        max_rk: maximal rank of the group within a gene
+        min_expr: minimal (aggregated) expression of the gene in the group
+        max_rel_rk: maximal rank of the gene within the group, relative to the number of genes
+        aggregate_fun: 'median' or 'mean', see `Aggregator`
+
+    Returns:
+        dict group -> sorted list of gene (row) indices. Groups without genes are included with an empty list.
+
+    >>> exprs = np.array([[10, 10, 0, 0, 0], [0, 0, 10, 8, 0], [5, 5, 5, 5, 5], [1, 1, 1, 1, 10]], dtype=float)
+    >>> gini_signatures(exprs, ["a", "a", "b", "b", "c"], min_gini=.5, max_rk=1, max_rel_rk=.5)
+    {'a': [0], 'b': [1], 'c': [3]}
+    """
+    agg = Aggregator(target)
+    # rows of the aggregator are samples -> aggregate the transposed matrix
+    aggregated = agg.aggregate(np.asarray(exprs).T, aggregate_fun).T
+    gini_index = gini(aggregated, axis=1)
+    group_rank = descending_ranks(aggregated, axis=1)
+    rel_gene_rank = (descending_ranks(aggregated, axis=0) - 1) / aggregated.shape[0]
+    selected = (gini_index[:, np.newaxis] >= min_gini) & (group_rank <= max_rk) & \
+               (aggregated >= min_expr) & (rel_gene_rank <= max_rel_rk)
+    return dict((group, np.flatnonzero(selected[:, j]).tolist()) for j, group in enumerate(agg.groups))
+
+
+def write_signatures_gmt(signatures, genes, filename, description="na"):
+    """
+    Write signatures of gene indices as gmt file with gene symbols.
+
+    Args:
+        signatures: dict group -> list of gene (row) indices, as returned by `gini_signatures`
+        genes: gene symbol of every row of the expression matrix
+        filename: output file
+        description: description of every signature, e.g. 'Gini>=0.7, Rank<=3, RPKM>=1'
+    """
+    genes = np.asarray(genes, dtype=object)
+    write_gmt(dict((group, genes[rows].tolist()) for group, rows in signatures.items() if len(rows) > 0), filename,
+              dict((group, description) for group in signatures))
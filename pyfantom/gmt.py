@@ -0,0 +1,151 @@
+"""
+Reading, writing and querying signatures in the gmt format.
+
+A gmt file has one signature per line: name, description and the genes, separated by tabs.
+Genes without a symbol are written as '-' (e.g. in exp.fantom5.tissue.grst.symbol.gmt);
+they are counted in `n_missing` but not added to the signatures.
+
+`GMTStore` reads any number of gmt files into a single gene vocabulary. Every signature is
+stored as a sorted array of integer gene ids (CSR arrays `indptr`, `indices`), which also
+make up the sparse signature x gene incidence matrix `matrix`.
+
+Usage:
+    store = GMTStore(glob.glob("../gmt/*.gmt"))
+    store.genes("exp.fantom5.tissue.grst.symbol", "adipose")
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+MISSING_GENE = "-"
+
+
+def read_gmt(filename):
+    """
+    Iterate over the signatures of a gmt file.
+
+    Yields:
+        (name, description, genes) for every line. genes is the list of the remaining fields,
+            including '-' entries.
+    """
+    with open(filename) as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if line:
+                fields = line.split("\t")
+                yield fields[0], fields[1], fields[2:]
+
+
+def write_gmt(signatures, filename, descriptions=None):
+    """
+    Write signatures to a gmt file.
+
+    Args:
+        signatures: dict signature name -> list of genes
+        filename: output file
+        descriptions: dict signature name -> description. Defaults to 'na'.
+    """
+    descriptions = descriptions if descriptions is not None else dict()
+    with open(filename, 'w') as f:
+        for name, genes in signatures.items():
+            f.write("\t".join([name, descriptions.get(name, "na")] + list(genes)) + "\n")
+
+
+class GMTStore:
+    """
+    Signatures of multiple gmt files over a common gene vocabulary.
+
+    Signatures are identified by the name of their file without extension (`source`) and their name.
+
+    >>> store = GMTStore(["../gmt/exp.fantom5.tissue.grst.symbol.gmt", "../gmt/exp.gtex.tissue.grst.symbol.gmt"])
+    >>> store.signatures.loc[("exp.fantom5.tissue.grst.symbol", "achilles tendon")].to_dict()
+    {'row': 0, 'description': 'na', 'n_genes': 64, 'n_missing': 1}
+    >>> store.genes("exp.fantom5.tissue.grst.symbol", "achilles tendon")[:3]
+    ['ACOD1', 'ADAM8', 'ANKRD22']
+    >>> store.signatures_with_gene("ALB")[-2:]
+    [('exp.gtex.tissue.grst.symbol', 'Liver'), ('exp.gtex.tissue.grst.symbol', 'Pancreas')]
+    >>> jaccard = store.jaccard()
+    >>> liver = ("exp.fantom5.tissue.grst.symbol", "liver"), ("exp.gtex.tissue.grst.symbol", "Liver")
+    >>> print(round(jaccard.loc[liver], 3))
+    0.469
+    """
+
+    def __init__(self, gmt_files):
+        """
+        Args:
+            gmt_files: list of paths to gmt files
+        """
+        self.gene_symbols = []
+        self.gene_index = dict()
+        rows = []
+        gene_lists = []
+        for gmt_file in gmt_files:
+            source = os.path.splitext(os.path.basename(gmt_file))[0]
+            for name, description, genes in read_gmt(gmt_file):
+                ids = [self._intern(gene) for gene in genes if gene != MISSING_GENE]
+                gene_lists.append(np.unique(np.array(ids, dtype=np.int32)))
+                rows.append((source, name, description, genes.count(MISSING_GENE)))
+        self.signatures = pd.DataFrame(rows, columns=["source", "name", "description", "n_missing"])
+        self.signatures.insert(0, "row", np.arange(len(rows)))
+        self.signatures.insert(4, "n_genes", [len(ids) for ids in gene_lists])
+        self.signatures.set_index(["source", "name"], inplace=True)
+        assert self.signatures.index.is_unique, "duplicated signature names"
+        self.indptr = np.concatenate([[0], np.cumsum(self.signatures.n_genes.values)]).astype(np.int64)
+        self.indices = np.concatenate(gene_lists) if gene_lists else np.zeros(0, dtype=np.int32)
+        self.matrix = sp.csr_matrix((np.ones(len(self.indices), dtype=np.int32), self.indices, self.indptr),
+                                    shape=(len(rows), len(self.gene_symbols)))
+        # gene x signature, to look up the signatures of a gene
+        self._matrix_t = self.matrix.T.tocsr()
+
+    def _intern(self, gene):
+        if gene not in self.gene_index:
+            self.gene_index[gene] = len(self.gene_symbols)
+            self.gene_symbols.append(gene)
+        return self.gene_index[gene]
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def row(self, source, name):
+        """Get the row of a signature in `matrix`."""
+        return self.signatures.row.at[(source, name)]
+
+    def gene_ids(self, source, name):
+        """Sorted int32 array of the gene ids of a signature."""
+        i = self.row(source, name)
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def genes(self, source, name):
+        """List of the gene symbols of a signature, sorted by gene id."""
+        return [self.gene_symbols[i] for i in self.gene_ids(source, name)]
+
+    def signatures_with_gene(self, gene):
+        """List of (source, name) of all signatures containing `gene`."""
+        if gene not in self.gene_index:
+            return []
+        i = self.gene_index[gene]
+        rows = self._matrix_t.indices[self._matrix_t.indptr[i]:self._matrix_t.indptr[i + 1]]
+        return list(self.signatures.index[np.sort(rows)])
+
+    def to_dict(self, source):
+        """Signatures of a single file as dict name -> list of genes, like `pygenesig.gini.load_gmt`."""
+        return dict((name, self.genes(source, name)) for name in self.signatures.loc[source].index)
+
+    def jaccard(self):
+        """
+        Pairwise jaccard index |A & B| / |A | B| of all signatures.
+
+        The intersections are computed with a single sparse matrix product.
+
+        Returns:
+            pd.DataFrame (signatures x signatures)
+        """
+        intersection = self.matrix.dot(self.matrix.T).toarray()
+        sizes = self.signatures.n_genes.values
+        union = sizes[:, np.newaxis] + sizes[np.newaxis, :] - intersection
+        with np.errstate(invalid="ignore", divide="ignore"):
+            jaccard = np.where(union > 0, intersection / union, 0.)
+        return pd.DataFrame(jaccard, index=self.signatures.index, columns=self.signatures.index)
@@ -1,5 +1,8 @@
+import os
+import time
+
 import networkx as nx
-from orangecontrib.bio.ontology import OBOOntology
+from pyfantom.ontology_index import OntologyIndex, super_term_ids, parent_term_ids
 import numpy as np
 import re
 import itertools
@@ -37,63 +40,386 @@ def relabel_nodes(obo, graph):
     return nx.relabel_nodes(graph, dict([(name, tag2name(obo, name)) for name in graph.nodes()]))
 
 
-def annotate_graph(graph, annotation_df, df_col='obo_id'):
-    """Add annotation to a networkx graph"""
-    for node in graph.nodes():
-        row = annotation_df[annotation_df[df_col] == node]
-        assert 0 <= len(row.index) <= 2     # 0 if the node is not a sample, 2 if there are technical replicates
-        if len(row.index) > 0:
-            for colname, value in zip(row.columns.values, row.iloc[0]):  # iloc 0 in case there are technical replicates
-                if colname == "name":
-                    continue  # dont overwrite native graph attributes
-                graph.node[node][colname] = numpy_conv(value)
+def annotate_graph(graph, annotation_df, df_col='obo_id', keep_replicates=False):
+    """
+    Add annotation to a networkx graph
+
+    The annotation is grouped by `df_col` once and the values are converted to
+    python's standard data types column-wise.
+
+    Args:
+        graph: networkx graph, nodes are named with obo-ids
+        annotation_df: sample annotation, e.g. column_vars.processed.csv
+        df_col: column of annotation_df that matches the nodes
+        keep_replicates: if False, the attributes are taken from the first row of a node
+            (in case there are technical replicates). If True, every attribute is
+            a list with one value per row.
+
+    >>> import pandas as pd
+    >>> annotation_df = pd.read_csv("test/testdata/dummy.osc.pdata.csv", index_col=0)
+    >>> graph = nx.Graph([("FF:12225-129F2", "FF:0000004")])
+    >>> graph = annotate_graph(graph, annotation_df)
+    >>> graph.nodes["FF:12225-129F2"]["lib_id"], graph.nodes["FF:0000004"]
+    ('CNhs12588', {})
+    >>> graph = annotate_graph(graph, annotation_df, keep_replicates=True)
+    >>> graph.nodes["FF:12225-129F2"]["lib_id"]
+    ['CNhs12588', 'CNhs12553']
+    """
+    annotation_df = annotation_df[annotation_df[df_col].isin(list(graph.nodes()))]
+    groups = annotation_df.groupby(df_col, sort=False).indices
+    # 0 if the node is not a sample, 2 if there are technical replicates
+    assert keep_replicates or all(len(rows) <= 2 for rows in groups.values())
+    for colname in annotation_df.columns:
+        if colname == "name":
+            continue  # dont overwrite native graph attributes
+        values = annotation_df[colname].tolist()
+        if keep_replicates:
+            node_values = dict((node, [values[i] for i in rows]) for node, rows in groups.items())
+        else:
+            node_values = dict((node, values[rows[0]]) for node, rows in groups.items())
+        nx.set_node_attributes(graph, values=node_values, name=colname)
     return graph
 
 
 def numpy_conv(var):
     """convert numpy datatype to python's standard data types"""
     if isinstance(var, np.generic):
-        return np.asscalar(var)
+        return var.item()
     else:
         return var
 
 
-def build_tree(obo, term, graph=nx.Graph(), maxdepth=None, filter_fun=lambda x: True):
+def _add_reachable(graph, term, next_terms, max_depth=None, depth=None):
+    """
+    Add the edges (t, u) for every u in next_terms(t), starting at term and
+    continuing with every u that is reached.
+
+    Iterative depth-first traversal with an explicit stack. Every term is expanded
+    only once (if the depth is limited: again, if it is reached on a shorter path),
+    such that shared ancestors are not revisited and cycles terminate.
+
+    Args:
+        graph: networkx graph to add the edges to
+        term: term to start with
+        next_terms: function term -> list of terms to add edges to
+        max_depth: terms at this depth (term has depth 0) are not expanded.
+        depth: dict term -> depth of the terms that were already expanded. Pass the same dict to
+            multiple calls (without max_depth) to expand every term only once for all of them.
+
+    >>> graph = _add_reachable(nx.Graph(), "A", {"A": ["B", "C"], "B": ["C"], "C": ["A"]}.get)
+    >>> sorted(graph.edges())
+    [('A', 'B'), ('A', 'C'), ('B', 'C')]
+    """
+    if max_depth is not None and max_depth <= 0:
+        return graph
+    if depth is None:
+        depth = dict()
+    elif term in depth and (max_depth is None or depth[term] == 0):
+        return graph
+    depth[term] = 0
+    stack = [(term, 0, iter(next_terms(term)))]
+    while stack:
+        current, current_depth, iterator = stack[-1]
+        next_term = next(iterator, None)
+        if next_term is None:
+            stack.pop()
+            continue
+        graph.add_edge(current, next_term)
+        next_depth = current_depth + 1
+        if next_term not in depth or (max_depth is not None and next_depth < depth[next_term]):
+            depth[next_term] = next_depth
+            if max_depth is None or next_depth < max_depth:
+                stack.append((next_term, next_depth, iter(next_terms(next_term))))
+    return graph
+
+
+def build_tree(obo, term, graph=None, maxdepth=None, filter_fun=lambda x: True):
     """
-    Recursively build a nxnetwork graph starting with 'term' (top-down).
+    Build a nxnetwork graph starting with 'term' (top-down).
 
     Builds the subgraph using an OBOOntology.
 
     Args:
         obo: OBOOntology to look up the child_terms
         term: the OBOOntology 'term' to start with
-        graph: networkX graph to add the nodes to
+        graph: networkX graph to add the nodes to (default: new graph)
         maxdepth: maximal recursion depth
         filter_fun: call back function on term.id, return True to include the element, False to exclude.
+
+    >>> from pyfantom.obo import OBOOntology
+    >>> obo = OBOOntology()
+    >>> obo.load(open("test/testdata/dummy_ontology.obo"))
+    >>> sorted(build_tree(obo, "F").nodes())
+    ['A', 'E', 'F']
+    >>> sorted(build_tree(obo, "F", maxdepth=2).nodes())
+    ['E', 'F']
     """
-    if maxdepth is not None:
-        maxdepth -= 1
-        if maxdepth <= 0:
-            return graph
-    children = obo.child_terms(term)
-    for child in children:
-        if filter_fun(child.id):
-            graph.add_edge(term, child.id)
-            build_tree(obo, child.id, graph, maxdepth)
+    if graph is None:
+        graph = nx.Graph()
+
+    def child_ids(term_id):
+        return [t.id for t in obo.child_terms(term_id) if filter_fun(t.id)]
+
+    return _add_reachable(graph, term, child_ids, None if maxdepth is None else maxdepth - 1)
+
+
+GRAPHML_TYPES = {bool: "boolean", int: "long", float: "double", str: "string"}
+
+
+def add_names(obo, graph, attr="name"):
+    """
+    Add the names of the terms as node attribute (instead of relabelling the nodes like relabel_nodes).
+
+    Args:
+        obo: OBOOntology or OntologyIndex for the id to name mapping
+        graph: networkx graph, nodes are named with obo-ids
+        attr: name of the node attribute
+    """
+    nx.set_node_attributes(graph, values=dict((node, tag2name(obo, node)) for node in graph.nodes()), name=attr)
     return graph
 
 
-def build_and_export_tree(obo, term, filename, maxdepth=None, annotation_df=None, df_col='obo_id', filter_fun=lambda x: True):
+def _export_value(value, join_lists=True):
+    """Convert an attribute value for the export: numpy -> python types, NaN -> None, lists -> ';'-separated"""
+    if isinstance(value, (list, tuple)):
+        value = [_export_value(v) for v in value]
+        return ";".join("" if v is None else str(v) for v in value) if join_lists else value
+    value = numpy_conv(value)
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
+def _attribute_types(items):
+    """Get the GraphML type of every attribute of the (node or edge) data dicts. Mixed types are exported as string."""
+    types = dict()
+    for data in items:
+        for key, value in data.items():
+            value = _export_value(value)
+            if value is None:
+                continue
+            value_type = GRAPHML_TYPES.get(type(value), "string")
+            types[key] = value_type if types.get(key, value_type) == value_type else "string"
+    return types
+
+
+def write_graphml_stream(graph, filename):
     """
-    Wrapper for build_tree. Build a tree and export it to graphml.
+    Write a graph to GraphML, element by element.
+
+    Unlike nx.write_graphml, no XML tree of the whole graph is built in memory.
+    Missing (None/NaN) values are omitted, lists are written as ';'-separated strings.
+
+    >>> import tempfile
+    >>> graph = nx.Graph([("A", "B")])
+    >>> nx.set_node_attributes(graph, values={"A": 1, "B": float("nan")}, name="count")
+    >>> with tempfile.NamedTemporaryFile(suffix=".graphml") as f:
+    ...     write_graphml_stream(graph, f.name)
+    ...     graph_ = nx.read_graphml(f.name)
+    >>> sorted(graph_.nodes(data=True))
+    [('A', {'count': 1}), ('B', {})]
+    """
+    from xml.sax.saxutils import escape, quoteattr
+    node_types = _attribute_types(data for _, data in graph.nodes(data=True))
+    edge_types = _attribute_types(data for _, _, data in graph.edges(data=True))
+    node_keys = dict((attr, "n{}".format(i)) for i, attr in enumerate(sorted(node_types)))
+    edge_keys = dict((attr, "e{}".format(i)) for i, attr in enumerate(sorted(edge_types)))
+
+    def format_value(value, value_type):
+        if value_type == "boolean":
+            return "true" if value else "false"
+        return escape(str(value))
+
+    def write_data(f, data, keys, types):
+        for attr, value in data.items():
+            value = _export_value(value)
+            if value is not None:
+                f.write('      <data key="{}">{}</data>\n'.format(keys[attr], format_value(value, types[attr])))
+
+    with open(filename, 'w') as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        f.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+        for domain, keys, types in [("node", node_keys, node_types), ("edge", edge_keys, edge_types)]:
+            for attr, key in sorted(keys.items(), key=lambda x: x[1]):
+                f.write('  <key id="{}" for="{}" attr.name={} attr.type="{}" />\n'.format(
+                    key, domain, quoteattr(str(attr)), types[attr]))
+        f.write('  <graph edgedefault="{}">\n'.format("directed" if graph.is_directed() else "undirected"))
+        for node, data in graph.nodes(data=True):
+            f.write('    <node id={}>\n'.format(quoteattr(str(node))))
+            write_data(f, data, node_keys, node_types)
+            f.write('    </node>\n')
+        for source, target, data in graph.edges(data=True):
+            f.write('    <edge source={} target={}>\n'.format(quoteattr(str(source)), quoteattr(str(target))))
+            write_data(f, data, edge_keys, edge_types)
+            f.write('    </edge>\n')
+        f.write('  </graph>\n</graphml>\n')
+
+
+def _graph_tables(graph):
+    """Get the node and the edge table of a graph as pd.DataFrame"""
+    import pandas as pd
+    nodes = pd.DataFrame([dict(((k, _export_value(v)) for k, v in data.items()), id=node)
+                          for node, data in graph.nodes(data=True)])
+    edges = pd.DataFrame([dict(((k, _export_value(v)) for k, v in data.items()), source=source, target=target)
+                          for source, target, data in graph.edges(data=True)])
+    nodes = nodes.reindex(columns=["id"] + [col for col in nodes.columns if col != "id"])
+    edges = edges.reindex(columns=["source", "target"] + [col for col in edges.columns if col not in ("source", "target")])
+    return nodes, edges
+
+
+def write_cytoscape_json(graph, filename):
+    """Write a graph in the Cytoscape.js JSON format, which can be imported by Cytoscape (File > Import > Network)"""
+    import json
+    data = nx.cytoscape_data(graph)
+    for element in itertools.chain(data["elements"]["nodes"], data["elements"]["edges"]):
+        element["data"] = dict((k, _export_value(v, join_lists=False)) for k, v in element["data"].items())
+    with open(filename, 'w') as f:
+        json.dump(data, f)
+
+
+def export_graph(graph, filename, obo=None):
+    """
+    Export a graph, the format is chosen by the extension of filename:
+        * .graphml: GraphML (see write_graphml_stream)
+        * .json, .cyjs: Cytoscape JSON
+        * .parquet, .tsv: edge list. The node attributes are written to <basename>.nodes.<ext>.
+
+    The write time and the size of the written files are reported.
+
+    Args:
+        graph: networkx graph, nodes are named with obo-ids
+        filename: output file
+        obo: if given, the names of the terms are exported as node attribute 'name' (see add_names).
+            The names are added to a copy, `graph` is not modified.
+
+    Returns:
+        list of files written
+
+    >>> import tempfile
+    >>> from pyfantom.obo import OBOOntology
+    >>> obo = OBOOntology()
+    >>> obo.load(open("test/testdata/dummy_ontology.obo"))
+    >>> graph = build_tree_bottom_up(obo, "A", nx.Graph())
+    >>> out_dir = tempfile.mkdtemp()
+    >>> files = export_graph(graph, os.path.join(out_dir, "tree.parquet"), obo)  # doctest: +ELLIPSIS
+    wrote 6 nodes and 5 edges to .../tree.parquet, .../tree.nodes.parquet in ...s (... kB)
+    >>> import pandas as pd
+    >>> nodes = pd.read_parquet(files[1]).set_index("id")
+    >>> sorted(nodes.index), nodes.name["A"]
+    (['A', 'B', 'C', 'D', 'E', 'F'], 'A: A')
+    """
+    start = time.time()
+    if obo is not None:
+        graph = add_names(obo, graph.copy())
+    base, ext = os.path.splitext(filename)
+    ext = ext.lower()
+    if ext == ".graphml":
+        write_graphml_stream(graph, filename)
+        files = [filename]
+    elif ext in (".json", ".cyjs"):
+        write_cytoscape_json(graph, filename)
+        files = [filename]
+    elif ext in (".parquet", ".tsv"):
+        nodes, edges = _graph_tables(graph)
+        files = [filename, base + ".nodes" + ext]
+        if ext == ".parquet":
+            edges.to_parquet(files[0], index=False)
+            nodes.to_parquet(files[1], index=False)
+        else:
+            edges.to_csv(files[0], sep="\t", index=False)
+            nodes.to_csv(files[1], sep="\t", index=False)
+    else:
+        raise ValueError("unknown graph format: {}".format(ext))
+    print("wrote {} nodes and {} edges to {} in {:.2f}s ({:.1f} kB)".format(
+        graph.number_of_nodes(), graph.number_of_edges(), ", ".join(files), time.time() - start,
+        sum(os.path.getsize(f) for f in files) / 1024))
+    return files
+
+
+def build_and_export_tree(obo, term, filename, maxdepth=None, annotation_df=None, df_col='obo_id', filter_fun=lambda x: True,
+                          relabel=False):
+    """
+    Wrapper for build_tree. Build a tree and export it with export_graph.
+
+    In the exported file, the nodes are named with obo-ids and the names of the terms are
+    stored in the node attribute 'name'.
+
+    Args:
+        relabel: if True, return a copy of the graph with the nodes relabelled by tag2name
+            (see relabel_nodes), like the graphml export did before. Off by default, as
+            relabelling copies the whole graph.
+
+    Returns:
+        the graph, nodes are named with obo-ids (or relabelled, see `relabel`)
     """
     graph = build_tree(obo, term, nx.Graph(), maxdepth, filter_fun=filter_fun)
     if annotation_df is not None:
         graph = annotate_graph(graph, annotation_df, df_col=df_col)
-    graph_ = relabel_nodes(obo, graph)
-    print("The graph has {} nodes".format(len(graph_.nodes())))
-    nx.write_graphml(graph_, filename)
-    return graph_
+    print("The graph has {} nodes".format(len(graph.nodes())))
+    export_graph(graph, filename, obo)
+    return relabel_nodes(obo, graph) if relabel else graph
+
+
+# terms that are excluded from the networks in notebook 04 (in addition to the ones covering all samples)
+DELIMITER_NAME_PATTERNS = [r"\d+ days sample$", r"\d+ minutes sample$", r"\d+ hr"]
+DELIMITER_ID_PATTERN = r"^(?:FF|UBERON|GS|CL)"
+
+
+def get_delimiter_nodes(obo, sample_ids, min_count=None, name_patterns=DELIMITER_NAME_PATTERNS,
+                        id_pattern=DELIMITER_ID_PATTERN):
+    """
+    Count the samples covered by every term and mark the delimiter nodes, like in notebook 04.
+
+    The counts are the column sums of the sample x super term incidence matrix
+    (`OntologyIndex.ancestor_matrix`). A term is a delimiter node if
+        * it covers at least `min_count` samples
+        * or its name matches one of `name_patterns` (time points)
+        * or its id does not match `id_pattern`
+
+    Args:
+        obo: OBOOntology or OntologyIndex
+        sample_ids: obo ids of the samples, e.g. col_vars.obo_id or the ids of a subset
+            of the samples (primary cells, tissues, cell lines)
+        min_count: defaults to the number of samples
+        name_patterns: list of regular expressions
+        id_pattern: regular expression
+
+    Returns:
+        pd.DataFrame with the columns count, delimiter, name indexed by obo_id, sorted by count.
+            Only terms covering at least one sample are included (cf. manual_annotation/delimiter_nodes.tsv).
+
+    >>> from pyfantom.obo import OBOOntology
+    >>> obo = OBOOntology()
+    >>> obo.load(open("test/testdata/dummy_ontology.obo"))
+    >>> get_delimiter_nodes(obo, ["A", "B", "E"], id_pattern=".").reset_index()
+      obo_id  count  delimiter name
+    0      C      2          0    C
+    1      D      2          0    D
+    2      F      2          0    F
+    3      B      1          0    B
+    4      E      1          0    E
+    >>> get_delimiter_nodes(obo, ["A", "B"], id_pattern="[A-C]").delimiter.to_dict()
+    {'C': 1, 'D': 1, 'B': 0, 'E': 1, 'F': 1}
+    """
+    import pandas as pd
+    index = obo if isinstance(obo, OntologyIndex) else OntologyIndex(obo)
+    sample_ids = list(sample_ids)
+    if min_count is None:
+        min_count = len(sample_ids)
+    counts = np.asarray(index.ancestor_matrix(sample_ids).sum(axis=0)).ravel()
+    covered = np.flatnonzero(counts)
+    # stable sort, terms with the same count are in integer id order
+    covered = covered[np.argsort(-counts[covered], kind="mergesort")]
+    delim_df = pd.DataFrame({
+        "count": counts[covered],
+        "name": [index.term(index.term_ids[i]).name for i in covered],
+    }, index=pd.Index(index.ids(covered), name="obo_id"))
+    delimiter = delim_df["count"].values >= min_count
+    for pattern in name_patterns:
+        delimiter |= delim_df.name.str.contains(pattern, regex=True, na=False).values
+    delimiter |= ~np.asarray(delim_df.index.str.contains(id_pattern, regex=True))
+    delim_df.insert(1, "delimiter", delimiter.astype(int))
+    return delim_df
 
 
 def add_superelements_to_graph(obo, term, graph, delimiter_nodes, inclusive=False):
@@ -103,39 +429,81 @@ def add_superelements_to_graph(obo, term, graph, delimiter_nodes, inclusive=Fals
     see build_tree_bottom_up_with_delimiters for more detailed explanation.
 
     Args:
-        obo: OBOOntology
+        obo: OBOOntology or OntologyIndex
         term: obo id, add the superelements of this term
         graph: networkx graph to add the elements to. Nodes must be named with obo-ids
         delimiter_nodes: list of nodes that serve as stopping criterion.
     """
-    parent_ids = [t.id for t in obo.parent_terms(term)]
-    super_term_ids = {parent_id: [t.id for t in obo.super_terms(parent_id)] for parent_id in parent_ids}
-    if inclusive:
-        for parent_id in super_term_ids:
-            # add parent to list of 'potential superelements'.
-            # recursion will no be aborted when parent element is reached, but it will also be added
-            super_term_ids[parent_id].append(parent_id)
-    if intersects(delimiter_nodes, parent_ids):
-        # is there are other delimiter nodes closer to the root we must continue, since
-        # we want to include these as well
-        if not intersects(delimiter_nodes, itertools.chain(*super_term_ids.values())):
-            return graph
-    for parent_id in parent_ids:
-        if intersects(delimiter_nodes, super_term_ids[parent_id]):
-            graph.add_edge(term, parent_id)
-            add_superelements_to_graph(obo, parent_id, graph, delimiter_nodes, inclusive)
+    return _add_reachable(graph, term, _superelement_parents(obo, delimiter_nodes, inclusive))
+
+
+def _superelement_parents(obo, delimiter_nodes, inclusive=False):
+    """
+    Get the function term id -> parents to continue with in add_superelements_to_graph.
+
+    Whether a term is a sub term of a delimiter node is memoized, such that
+    the super terms of every term are looked up only once.
+    """
+    delimiter_nodes = set(delimiter_nodes)
+    under_delimiter = dict()
+
+    def is_under_delimiter(term_id):
+        if term_id not in under_delimiter:
+            # if inclusive, the term itself is a 'potential superelement'.
+            # traversal will no be aborted when a delimiter is reached, but it will also be added
+            under_delimiter[term_id] = intersects(delimiter_nodes, super_term_ids(obo, term_id)) or \
+                (inclusive and term_id in delimiter_nodes)
+        return under_delimiter[term_id]
+
+    def superelement_parents(term_id):
+        parent_ids = parent_term_ids(obo, term_id)
+        parents_under_delimiter = [is_under_delimiter(parent_id) for parent_id in parent_ids]
+        if intersects(delimiter_nodes, parent_ids):
+            # is there are other delimiter nodes closer to the root we must continue, since
+            # we want to include these as well
+            if not any(parents_under_delimiter):
+                return []
+        return [parent_id for parent_id, under in zip(parent_ids, parents_under_delimiter) if under]
+
+    return superelement_parents
+
+
+def build_superelement_graph(obo, terms, delimiter_nodes, graph=None, inclusive=False):
+    """
+    Batch version of add_superelements_to_graph: add the superelements of all terms to the graph.
+
+    The result is the union of calling add_superelements_to_graph for every term, however
+    the delimiter status of a term is computed only once and every term is expanded
+    only once for the whole batch.
+
+    Args:
+        obo: OBOOntology or OntologyIndex
+        terms: obo ids, e.g. the obo ids of all samples
+        delimiter_nodes: list of nodes that serve as stopping criterion.
+        graph: networkx graph to add the elements to (default: new graph)
+        inclusive: see add_superelements_to_graph
+
+    >>> from pyfantom.obo import OBOOntology
+    >>> obo = OBOOntology()
+    >>> obo.load(open("test/testdata/dummy_ontology.obo"))
+    >>> sorted(build_superelement_graph(obo, ["A", "C"], ["B", "D", "F"]).nodes())
+    ['A', 'B', 'C', 'E']
+    """
+    if graph is None:
+        graph = nx.Graph()
+    superelement_parents = _superelement_parents(obo, delimiter_nodes, inclusive)
+    depth = dict()
+    for term in terms:
+        _add_reachable(graph, term, superelement_parents, depth=depth)
     return graph
 
 
 def build_tree_bottom_up(obo, term, graph, max_depth=None, filter_fun=lambda x: True):
     """Add all parents of term to the graph with respect to max_depth and filter_fun"""
-    parent_ids = [t.id for t in obo.parent_terms(term)]
-    if max_depth is None or max_depth > 0:
-        for parent_id in parent_ids:
-            if filter_fun(parent_id):
-                graph.add_edge(term, parent_id)
-                build_tree_bottom_up(obo, parent_id, graph, max_depth=None if max_depth is None else max_depth-1, filter_fun=filter_fun)
-    return graph
+    def parent_ids(term_id):
+        return [t.id for t in obo.parent_terms(term_id) if filter_fun(t.id)]
+
+    return _add_reachable(graph, term, parent_ids, max_depth)
 
 
 def build_tree_bottom_up_with_delimiters(obo, term, graph, delimiter_nodes):
@@ -146,8 +514,6 @@ def build_tree_bottom_up_with_delimiters(obo, term, graph, delimiter_nodes):
     This is essentially the same as add_superelements_to_graph, except that that
     function considers children of *any* delimiter node.
 
-    Note: function does not terminate if ontology contains circles.
-
     Example:
          ---------- A ---------
         |                      |
@@ -166,6 +532,7 @@ def build_tree_bottom_up_with_delimiters(obo, term, graph, delimiter_nodes):
         graph: networkx graph to add the elements to. Nodes must be named with obo-ids
         delimiter_nodes: list of nodes that serve as stopping criterion.
 
+    >>> from pyfantom.obo import OBOOntology
     >>> obo = OBOOntology()
     >>> obo.load(open("test/testdata/dummy_ontology.obo"))
     >>> graph = nx.Graph()
@@ -181,15 +548,19 @@ def build_tree_bottom_up_with_delimiters(obo, term, graph, delimiter_nodes):
     >>> sorted(graph.nodes())
     ['A', 'B', 'C', 'D', 'E', 'F']
     >>> graph = nx.Graph()
+    >>> graph = add_superelements_to_graph(OntologyIndex(obo), "A", graph, ["B", "D", "F"])
+    >>> sorted(graph.nodes())
+    ['A', 'B', 'C', 'E']
+    >>> graph = nx.Graph()
     >>> graph = build_tree_bottom_up(obo, "A", graph, max_depth=2)
     >>> sorted(graph.nodes())
     ['A', 'B', 'C', 'E', 'F']
     """
-    parent_ids = [t.id for t in obo.parent_terms(term)]
-    for parent_id in parent_ids:
+    delimiter_nodes = set(delimiter_nodes)
+
+    def parent_ids(term_id):
         # if a parent is in delimiter_nodes we discard that branch.
-        if parent_id not in delimiter_nodes:
-            graph.add_edge(term, parent_id)
-            build_tree_bottom_up_with_delimiters(obo, parent_id, graph, delimiter_nodes)
-    return graph
+        return [t.id for t in obo.parent_terms(term_id) if t.id not in delimiter_nodes]
+
+    return _add_reachable(graph, term, parent_ids)
 
@@ -0,0 +1,397 @@
+"""
+Lightweight parser for ontologies in the obo format.
+
+Drop-in replacement for `orangecontrib.bio.ontology.OBOOntology` implementing the subset of
+its API used in this project, without the import cost of orangecontrib.bio.
+
+The file is read line by line. All strings (ids, tag values, ...) are interned into a single
+string table, the tags of the objects are stored as integer arrays referring to that table
+and the relations as CSR arrays of integer object ids. Term objects (`OBOTerm`) are only
+created on access.
+
+Usage:
+    obo = OBOOntology()
+    obo.load(open("../data/ff-phase2-140729.obo"))
+"""
+
+import logging
+
+import numpy as np
+
+EDGE_COLORS = {"is_a": "red"}
+
+
+class OBOTerm:
+    """
+    Lightweight term of an ontology.
+
+    Implements the attributes of orange's Term used in this project (`id`, `name`, `tags()`).
+    """
+
+    def __init__(self, term_id, name, tag_values):
+        self.id = term_id
+        self.name = name
+        self.tag_values = tag_values
+
+    def tags(self):
+        """Return a list of all (tag, value, modifiers, comment) tuples."""
+        return list(self.tag_values)
+
+    def __eq__(self, other):
+        return isinstance(other, OBOTerm) and self.id == other.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return "OBOTerm(id={!r}, name={!r})".format(self.id, self.name)
+
+
+class TermTable:
+    """
+    Term lookup of an array-backed ontology.
+
+    The tags of all objects are stored as integer arrays (tag_indptr: CSR row pointer per object;
+    tag_key, tag_value, tag_modifiers, tag_comment: positions in `strings`, -1 for None).
+    OBOTerm objects are only created on access.
+    """
+
+    def __init__(self, strings, term_codes, tag_indptr, tag_key, tag_value, tag_modifiers, tag_comment):
+        self.strings = strings
+        self.term_ids = [strings[i] for i in np.asarray(term_codes).tolist()]
+        self.id_to_index = {term_id: i for i, term_id in enumerate(self.term_ids)}
+        self.tag_indptr = tag_indptr
+        self.tag_key = tag_key
+        self.tag_value = tag_value
+        self.tag_modifiers = tag_modifiers
+        self.tag_comment = tag_comment
+        self._terms = dict()
+        # alternative ids
+        self.alt_ids = dict()
+        alt_id_code = self._code("alt_id")
+        if alt_id_code is not None:
+            positions = np.flatnonzero(tag_key == alt_id_code)
+            rows = np.searchsorted(tag_indptr, positions, side="right") - 1
+            self.alt_ids = dict((strings[tag_value[pos]], self.term_ids[row]) for pos, row in zip(positions, rows))
+
+    def _code(self, string):
+        try:
+            return self.strings.index(string)
+        except ValueError:
+            return None
+
+    def _string(self, code):
+        return None if code < 0 else self.strings[code]
+
+    def _make_term(self, i):
+        tags = [(self.strings[self.tag_key[j]], self._string(self.tag_value[j]), self._string(self.tag_modifiers[j]),
+                 self._string(self.tag_comment[j])) for j in range(self.tag_indptr[i], self.tag_indptr[i + 1])]
+        name = next((value for key, value, _, _ in tags if key == "name"), None)
+        return OBOTerm(self.term_ids[i], name, tags)
+
+    def __len__(self):
+        return len(self.term_ids)
+
+    def index(self, term_id):
+        """Get the integer id for an id or an alternative id."""
+        term_id = self.alt_ids.get(term_id, term_id)
+        if term_id not in self.id_to_index:
+            raise ValueError("Unknown term id: {!r}".format(term_id))
+        return self.id_to_index[term_id]
+
+    def term(self, term_id):
+        """Get the OBOTerm for an id or an alternative id."""
+        i = self.index(term_id)
+        if i not in self._terms:
+            self._terms[i] = self._make_term(i)
+        return self._terms[i]
+
+    def terms(self):
+        return [self.term(term_id) for term_id in self.term_ids]
+
+
+def _find_unescaped(string, char):
+    i = string.find(char)
+    while i != -1 and string[i - 1] == "\\":
+        i = string.find(char, i + 1)
+    return i
+
+
+def _rfind_unescaped(string, char):
+    i = string.rfind(char)
+    while i != -1 and string[i - 1] == "\\":
+        i = string.rfind(char, 0, i - 1)
+    return i
+
+
+def parse_tag_value(line):
+    """
+    Parse a tag-value line into a (tag, value, modifiers, comment) tuple, like orange's `parse_tag_value`.
+
+    >>> parse_tag_value("is_a: BFO:0000040 ! material entity")
+    ('is_a', 'BFO:0000040', None, 'material entity')
+    >>> parse_tag_value("foo: bar [baz:0] { fizz=buzz } ! Comment")
+    ('foo', 'bar [baz:0]', 'fizz=buzz', 'Comment')
+    """
+    modifiers = comment = None
+    if "!" in line:
+        i = _rfind_unescaped(line, "!")
+        if i != -1:
+            line, comment = line[:i].rstrip(" "), line[i + 1:].lstrip(" ")
+    i = _find_unescaped(line, ":")
+    if i != -1:
+        tag, value = line[:i].rstrip(" "), line[i + 1:].strip()
+    else:
+        tag, value = line.rstrip(), ""
+    if value.endswith("}") and not value.endswith("\\}"):
+        i = _rfind_unescaped(value, "{")
+        if i != -1:
+            value, modifiers = value[:i].rstrip(" "), value[i + 1:].lstrip(" ")[:-1].rstrip()
+    return tag, value, modifiers, comment
+
+
+class OBOOntology:
+    """
+    Array-backed ontology, see the module documentation.
+
+    >>> obo = OBOOntology()
+    >>> obo.load(open("test/testdata/dummy_ontology.obo"))
+    >>> obo.term("A").name, sorted(t.id for t in obo.parent_terms("A"))
+    ('A', ['B', 'E'])
+    >>> sorted(t.id for t in obo.super_terms("A")), sorted(t.id for t in obo.sub_terms("C"))
+    (['B', 'C', 'D', 'E', 'F'], ['A', 'B'])
+    >>> sorted(t.id for t in obo.root_terms())
+    ['D', 'F']
+    >>> sorted(obo.to_networkx(["B"]).edges())
+    [('B', 'C'), ('C', 'D')]
+    """
+
+    def __init__(self, file=None):
+        self.header_tags = []
+        self.strings = []
+        self._string_codes = dict()
+        self.stanza_types = np.zeros(0, dtype=np.int32)
+        self.table = TermTable([], [], np.zeros(1, dtype=np.int64), *[np.zeros(0, dtype=np.int32)] * 4)
+        self.parent_indptr = np.zeros(1, dtype=np.int64)
+        self.parent_indices = np.zeros(0, dtype=np.int32)
+        self.parent_types = np.zeros(0, dtype=np.int32)
+        self.child_indptr = np.zeros(1, dtype=np.int64)
+        self.child_indices = np.zeros(0, dtype=np.int32)
+        self.child_types = np.zeros(0, dtype=np.int32)
+        if file is not None:
+            self.load(file)
+
+    def _intern(self, string):
+        if string is None:
+            return -1
+        code = self._string_codes.get(string)
+        if code is None:
+            code = self._string_codes[string] = len(self.strings)
+            self.strings.append(string)
+        return code
+
+    def load(self, file):
+        """
+        Load the objects from a file in obo format.
+
+        Args:
+            file: file object or filename
+
+        Raises:
+            ValueError: if a stanza has no id tag
+        """
+        assert len(self) == 0, "the ontology is already loaded"
+        if isinstance(file, str):
+            file = open(file, encoding="utf-8")
+        intern = self._intern
+        object_codes = []
+        stanza_types = []
+        stanza_lines = []
+        tag_indptr = [0]
+        tag_codes = []
+        in_header = True
+        in_stanza = False
+        for line_no, line in enumerate(file, 1):
+            line = line.rstrip("\r\n")
+            if line.startswith("[") and line.endswith("]"):
+                in_header = False
+                in_stanza = True
+                stanza_types.append(intern(line.strip("[]")))
+                stanza_lines.append(line_no)
+                object_codes.append(-1)
+            elif in_header:
+                if line.strip():
+                    self.header_tags.append(tuple(line.split(": ", 1)))
+            elif line.startswith("!"):
+                continue
+            elif line:
+                tag, value, modifiers, comment = parse_tag_value(line)
+                value_code = intern(value)
+                if tag == "id":
+                    object_codes[-1] = value_code
+                tag_codes += (intern(tag), value_code, -1 if modifiers is None else intern(modifiers),
+                              -1 if comment is None else intern(comment))
+            elif in_stanza:  # empty line is the end of a stanza
+                tag_indptr.append(len(tag_codes) // 4)
+                in_stanza = False
+        if in_stanza:
+            tag_indptr.append(len(tag_codes) // 4)
+        if -1 in object_codes:
+            raise ValueError("stanza without id at line {}".format(stanza_lines[object_codes.index(-1)]))
+
+        tag_codes = np.array(tag_codes, dtype=np.int32).reshape(-1, 4)
+        self.stanza_types = np.array(stanza_types, dtype=np.int32)
+        self.table = TermTable(self.strings, object_codes, np.array(tag_indptr, dtype=np.int64),
+                               tag_codes[:, 0], tag_codes[:, 1], tag_codes[:, 2], tag_codes[:, 3])
+        self._index_relations()
+
+    def _index_relations(self):
+        """Build the CSR arrays of the (is_a and relationship) edges, object -> parent"""
+        table = self.table
+        n = len(table)
+        is_a = self._string_codes.get("is_a", -1)
+        relationship = self._string_codes.get("relationship", -1)
+        positions = np.flatnonzero((table.tag_key == is_a) | (table.tag_key == relationship))
+        rows = np.searchsorted(table.tag_indptr, positions, side="right") - 1
+        edges = []
+        for pos, row in zip(positions.tolist(), rows.tolist()):
+            value = table.strings[table.tag_value[pos]]
+            if table.tag_key[pos] == is_a:
+                rel_type, parent_id = is_a, value
+            else:
+                rel_type, parent_id = value.split(None, 1)
+                rel_type = self._intern(rel_type)
+            try:
+                edges.append((row, table.index(parent_id), rel_type))
+            except ValueError:
+                logging.warning("{}: unknown parent term {}".format(table.term_ids[row], parent_id))
+        edges = np.array(edges, dtype=np.int32).reshape(-1, 3)
+        # sort by (object, parent); of duplicate edges the last one in the file wins, like in orange
+        order = np.lexsort((-np.arange(len(edges)), edges[:, 1], edges[:, 0]))
+        edges = edges[order]
+        keep = np.ones(len(edges), dtype=bool)
+        keep[1:] = (edges[1:, 0] != edges[:-1, 0]) | (edges[1:, 1] != edges[:-1, 1])
+        edges = edges[keep]
+        self.parent_indptr = np.concatenate([[0], np.cumsum(np.bincount(edges[:, 0], minlength=n))])
+        self.parent_indices = edges[:, 1]
+        self.parent_types = edges[:, 2]
+        order = np.lexsort((edges[:, 0], edges[:, 1]))
+        self.child_indptr = np.concatenate([[0], np.cumsum(np.bincount(edges[:, 1], minlength=n))])
+        self.child_indices = edges[order, 0]
+        self.child_types = edges[order, 2]
+
+    def __len__(self):
+        return len(self.table)
+
+    def __contains__(self, term_id):
+        return term_id in self.table.id_to_index
+
+    def __iter__(self):
+        return iter(self.table.terms())
+
+    def _index(self, term):
+        return self.table.index(term if isinstance(term, str) else term.id)
+
+    def _terms(self, indices):
+        return set(self.table.term(self.table.term_ids[i]) for i in indices)
+
+    def _closure(self, term, indptr, indices):
+        """Integer ids of all objects reachable from term"""
+        visited = np.zeros(len(self), dtype=bool)
+        stack = [self._index(term)]
+        while stack:
+            i = stack.pop()
+            for j in indices[indptr[i]:indptr[i + 1]]:
+                if not visited[j]:
+                    visited[j] = True
+                    stack.append(j)
+        return np.flatnonzero(visited)
+
+    def _stanza_type(self, i):
+        return self.strings[self.stanza_types[i]]
+
+    def term(self, term):
+        """Get the term by id (or alternative id). OBOTerm objects are returned unchanged."""
+        if isinstance(term, OBOTerm):
+            return term
+        return self.table.term(term)
+
+    def terms(self):
+        """All [Term] objects of the ontology"""
+        return [self.table.term(term_id) for i, term_id in enumerate(self.table.term_ids)
+                if self._stanza_type(i) == "Term"]
+
+    def typedefs(self):
+        """All [Typedef] objects of the ontology"""
+        return [self.table.term(term_id) for i, term_id in enumerate(self.table.term_ids)
+                if self._stanza_type(i) == "Typedef"]
+
+    def parent_terms(self, term):
+        i = self._index(term)
+        return self._terms(self.parent_indices[self.parent_indptr[i]:self.parent_indptr[i + 1]])
+
+    def child_terms(self, term):
+        i = self._index(term)
+        return self._terms(self.child_indices[self.child_indptr[i]:self.child_indptr[i + 1]])
+
+    def super_terms(self, term):
+        return self._terms(self._closure(term, self.parent_indptr, self.parent_indices))
+
+    def sub_terms(self, term):
+        return self._terms(self._closure(term, self.child_indptr, self.child_indices))
+
+    def root_terms(self):
+        """All terms without parents"""
+        has_parents = np.diff(self.parent_indptr) > 0
+        return [term for term in self.terms() if not has_parents[self._index(term)]]
+
+    def to_networkx(self, terms=None):
+        """
+        Get a networkx DiGraph (term -> parent) of the ontology, like OBOOntology.to_networkx.
+
+        Args:
+            terms: if not None, only these terms and their super terms are included.
+        """
+        import networkx
+        if terms is None:
+            indices = [i for i in range(len(self)) if self._stanza_type(i) == "Term"]
+        else:
+            indices = set(self._index(term) for term in terms)
+            for term in terms:
+                indices.update(self._closure(term, self.parent_indptr, self.parent_indices).tolist())
+        included = np.zeros(len(self), dtype=bool)
+        included[list(indices)] = True
+        graph = networkx.DiGraph()
+        for i in indices:
+            term = self.table.term(self.table.term_ids[i])
+            graph.add_node(term.id, name=term.name)
+        for i in indices:
+            for j in range(self.parent_indptr[i], self.parent_indptr[i + 1]):
+                parent = self.parent_indices[j]
+                if included[parent]:
+                    rel_type = self.strings[self.parent_types[j]]
+                    graph.add_edge(self.table.term_ids[i], self.table.term_ids[parent], label=rel_type,
+                                   color=EDGE_COLORS.get(rel_type, "blue"))
+        return graph
+
+    def write(self, stream):
+        """
+        Write the ontology in obo format.
+
+        Args:
+            stream: file object or filename
+        """
+        if isinstance(stream, str):
+            with open(stream, 'w', encoding="utf-8") as f:
+                return self.write(f)
+        for key, value in self.header_tags:
+            stream.write(key + ": " + value + "\n")
+        for i, term_id in enumerate(self.table.term_ids):
+            stream.write("\n[{}]\n".format(self._stanza_type(i)))
+            for tag, value, modifiers, comment in self.table.term(term_id).tags():
+                line = [tag + ": " + value]
+                if modifiers:
+                    line.append("{ " + modifiers + " }")
+                if comment:
+                    line.append("! " + comment)
+                stream.write(" ".join(line) + "\n")
@@ -0,0 +1,189 @@
+"""
+Persistent on-disk cache of parsed ontologies.
+
+The first time an obo file is loaded, it is parsed with `pyfantom.obo.OBOOntology` and a binary
+snapshot (a directory with one .npy file per array and a meta.json) is written to the cache
+directory. Later loads read the snapshot instead of parsing the obo file:
+    * all strings (ids, names, tag values) are interned into a single string table,
+      the terms and their tags are stored as integer arrays referring to that table.
+    * the parent relation and its transitive closure are stored as the arrays of `OntologyIndex`.
+    * the sample type of every term, as bitmask (see `pyfantom.parse_ontology.get_sample_types`).
+The arrays are memory-mapped when the snapshot is read.
+
+The snapshot is keyed by the name and the absolute path of the obo file and validated by its
+modification time and size, and by the sha1 hash of its content if the modification time changed.
+The raw and the corrected ontology (ff-phase2-140729.obo, ff-phase2-140729.corr.obo), as well as
+copies of an ontology in different directories, are cached separately.
+
+Usage:
+    obo = load_ontology("../data/ff-phase2-140729.corr.obo")
+    obo.term("FF:0000001").name
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+from pyfantom.obo import OBOOntology, TermTable
+from pyfantom.ontology_index import OntologyIndex
+from pyfantom.parse_ontology import sample_type_bits
+
+# increment when the layout of the snapshot changes
+CACHE_VERSION = 2
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pyfantom")
+# the strings of the string table are joined with this separator
+STRING_SEPARATOR = "\0"
+META_FILE = "meta.json"
+
+
+def file_hash(filename):
+    """sha1 hash of the content of a file"""
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def _snapshot_dir(obo_file, cache_dir):
+    path_hash = hashlib.sha1(os.path.abspath(obo_file).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(cache_dir, "{}.{}.snapshot".format(os.path.basename(obo_file), path_hash))
+
+
+def _source_info(obo_file):
+    stat = os.stat(obo_file)
+    return {"mtime": stat.st_mtime, "size": stat.st_size}
+
+
+def write_snapshot(obo, snapshot_dir, source_info):
+    """
+    Write a snapshot of an ontology.
+
+    Args:
+        obo: OBOOntology
+        snapshot_dir: output directory
+        source_info: dict describing the source file (mtime, size, sha1) to validate the snapshot
+    """
+    index = OntologyIndex(obo)
+    strings = []
+    string_codes = dict()
+
+    def intern(string):
+        if string is None:
+            return -1
+        assert STRING_SEPARATOR not in string, "cannot store string: {!r}".format(string)
+        if string not in string_codes:
+            string_codes[string] = len(strings)
+            strings.append(string)
+        return string_codes[string]
+
+    term_codes = [intern(term_id) for term_id in index.term_ids]
+    tags = [obo.term(term_id).tags() for term_id in index.term_ids]
+    tag_indptr = np.zeros(len(tags) + 1, dtype=np.int64)
+    tag_indptr[1:] = np.cumsum([len(term_tags) for term_tags in tags])
+    tag_codes = np.array([[intern(x) for x in tag] for term_tags in tags for tag in term_tags],
+                         dtype=np.int32).reshape(-1, 4)
+
+    arrays = dict((name, getattr(index, name)) for name in OntologyIndex.ARRAYS)
+    arrays["term_codes"] = np.array(term_codes, dtype=np.int32)
+    arrays["tag_indptr"] = tag_indptr
+    arrays["tag_codes"] = tag_codes
+    arrays["sample_type_bits"] = sample_type_bits(index)
+    os.makedirs(snapshot_dir)
+    for name, array in arrays.items():
+        np.save(os.path.join(snapshot_dir, name + ".npy"), array)
+    with open(os.path.join(snapshot_dir, "strings.txt"), 'w', encoding="utf-8") as f:
+        f.write(STRING_SEPARATOR.join(strings))
+    write_snapshot_meta(snapshot_dir, source_info)
+
+
+def write_snapshot_meta(snapshot_dir, source_info):
+    """Write the description of the source file of a snapshot"""
+    tmp_file = os.path.join(snapshot_dir, META_FILE + ".{}.tmp".format(os.getpid()))
+    with open(tmp_file, 'w') as f:
+        json.dump(dict(source_info, version=CACHE_VERSION), f)
+    os.replace(tmp_file, os.path.join(snapshot_dir, META_FILE))
+
+
+def read_snapshot_meta(snapshot_dir):
+    """Read the description of the source file of a snapshot"""
+    with open(os.path.join(snapshot_dir, META_FILE)) as f:
+        return json.load(f)
+
+
+def read_snapshot(snapshot_dir):
+    """
+    Read a snapshot written by `write_snapshot`.
+
+    Returns:
+        OntologyIndex, with a TermTable as ontology.
+    """
+    def load(name):
+        return np.load(os.path.join(snapshot_dir, name + ".npy"), mmap_mode='r')
+
+    with open(os.path.join(snapshot_dir, "strings.txt"), encoding="utf-8") as f:
+        strings = f.read().split(STRING_SEPARATOR)
+    tag_codes = load("tag_codes")
+    terms = TermTable(strings, load("term_codes"), load("tag_indptr"), tag_codes[:, 0], tag_codes[:, 1],
+                      tag_codes[:, 2], tag_codes[:, 3])
+    arrays = dict((name, load(name)) for name in OntologyIndex.ARRAYS)
+    index = OntologyIndex.from_arrays(terms, terms.term_ids, arrays)
+    index.sample_type_bits = load("sample_type_bits")
+    return index
+
+
+def load_ontology(obo_file, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Load an ontology, from the snapshot in the cache if it is up to date.
+
+    Args:
+        obo_file: path to the obo file
+        cache_dir: directory of the snapshots. If None, the obo file is parsed without caching.
+
+    Returns:
+        OntologyIndex. It implements the subset of the OBOOntology API used in this project,
+            the terms are OBOTerm objects.
+
+    >>> import tempfile
+    >>> cache_dir = tempfile.mkdtemp()
+    >>> obo = load_ontology("test/testdata/ff-phase2-140729.obo", cache_dir)
+    >>> [name.startswith("ff-phase2-140729.obo.") for name in os.listdir(cache_dir)]
+    [True]
+    >>> obo = load_ontology("test/testdata/ff-phase2-140729.obo", cache_dir)
+    >>> obo.term("FF:11931-125I5").name, obo.term("FF:11931-125I5").tags()[-1]
+    ('Reticulocytes, rep1', ('is_a', 'FF:0011169', None, 'human reticulocyte sample'))
+    >>> sorted(obo.parent_term_ids("FF:11931-125I5"))
+    ['EFO:0002091', 'FF:0000002', 'FF:0011169']
+    """
+    if cache_dir is None:
+        obo = OBOOntology()
+        obo.load(open(obo_file))
+        return OntologyIndex(obo)
+
+    snapshot_dir = _snapshot_dir(obo_file, cache_dir)
+    source_info = _source_info(obo_file)
+    if os.path.exists(os.path.join(snapshot_dir, META_FILE)):
+        meta = read_snapshot_meta(snapshot_dir)
+        if meta["version"] == CACHE_VERSION:
+            if meta["mtime"] == source_info["mtime"] and meta["size"] == source_info["size"]:
+                return read_snapshot(snapshot_dir)
+            source_info["sha1"] = file_hash(obo_file)
+            if meta["sha1"] == source_info["sha1"]:
+                # the file was touched, but not changed: store the new mtime to skip hashing next time
+                write_snapshot_meta(snapshot_dir, source_info)
+                return read_snapshot(snapshot_dir)
+
+    obo = OBOOntology()
+    obo.load(open(obo_file))
+    os.makedirs(cache_dir, exist_ok=True)
+    if "sha1" not in source_info:
+        source_info["sha1"] = file_hash(obo_file)
+    # write to a temporary directory first, such that readers never see a partial snapshot
+    tmp_dir = snapshot_dir + ".{}.tmp".format(os.getpid())
+    write_snapshot(obo, tmp_dir, source_info)
+    if os.path.exists(snapshot_dir):
+        shutil.rmtree(snapshot_dir)
+    os.rename(tmp_dir, snapshot_dir)
+    return read_snapshot(snapshot_dir)
@@ -0,0 +1,319 @@
+import numpy as np
+from collections import deque
+
+
+class OntologyIndex:
+    """
+    Precomputed transitive closure of an OBOOntology.
+
+    Every term is interned to an integer id. The parent relation and its transitive
+    closure (ancestors and descendants) are stored as CSR arrays (`indptr`, `indices`) of
+    these integer ids. Additionally, the ancestors are stored as a packed bitset
+    (one row of bits per term) such that "is X under Y" is a single bit lookup.
+
+    The index implements the subset of the OBOOntology API used in this project
+    (`term`, `terms`, `parent_terms`, `child_terms`, `super_terms`, `sub_terms`) and
+    can be passed to `parse_ontology`, `dendro_tools` and `network_tools` in place of
+    the raw ontology.
+
+    Note: the index is a snapshot. If the ontology is modified, the index needs to be rebuilt.
+
+    >>> from pyfantom.obo import OBOOntology
+    >>> obo = OBOOntology()
+    >>> obo.load(open("test/testdata/dummy_ontology.obo"))
+    >>> idx = OntologyIndex(obo)
+    >>> sorted(idx.super_term_ids("A"))
+    ['B', 'C', 'D', 'E', 'F']
+    >>> sorted(idx.sub_term_ids("C"))
+    ['A', 'B']
+    >>> idx.is_under("A", "D"), idx.is_under("D", "A"), idx.is_under("E", "E")
+    (True, False, False)
+    >>> idx.ancestor_matrix(["A", "E"]).toarray()
+    array([[0, 1, 1, 1, 1, 1],
+           [0, 0, 0, 0, 0, 1]], dtype=int32)
+    >>> sorted(t.id for t in idx.super_terms("B"))
+    ['C', 'D']
+    """
+
+    # arrays that make up the index (see `from_arrays`)
+    ARRAYS = ("parent_indptr", "parent_indices", "child_indptr", "child_indices", "ancestor_bits",
+              "ancestor_indptr", "ancestor_indices", "descendant_indptr", "descendant_indices")
+
+    def __init__(self, obo):
+        """
+        Build the index from an ontology.
+
+        Args:
+            obo: OBOOntology
+        """
+        self.obo = obo
+        self.term_ids = [term.id for term in obo.terms()]
+        self.id_to_index = {term_id: i for i, term_id in enumerate(self.term_ids)}
+        n_terms = len(self.term_ids)
+        parent_lists = [sorted(self.id_to_index[t.id] for t in obo.parent_terms(term_id))
+                        for term_id in self.term_ids]
+        self.parent_indptr, self.parent_indices = self._to_csr(parent_lists)
+        self.child_indptr, self.child_indices = self._transpose(self.parent_indptr, self.parent_indices, n_terms)
+        self.ancestor_bits = self._compute_ancestor_bits(n_terms)
+        self.ancestor_indptr, self.ancestor_indices = self._to_csr(
+            np.flatnonzero(np.unpackbits(row, count=n_terms)) for row in self.ancestor_bits)
+        self.descendant_indptr, self.descendant_indices = self._transpose(
+            self.ancestor_indptr, self.ancestor_indices, n_terms)
+
+    @classmethod
+    def from_arrays(cls, obo, term_ids, arrays):
+        """
+        Restore an index from its arrays, e.g. from a snapshot written by `pyfantom.ontology_cache`.
+
+        Args:
+            obo: ontology to look up the terms (OBOOntology or an object implementing `term`)
+            term_ids: list of obo ids in integer id order
+            arrays: dict name -> np.array for every name in `ARRAYS`
+        """
+        index = cls.__new__(cls)
+        index.obo = obo
+        index.term_ids = list(term_ids)
+        index.id_to_index = {term_id: i for i, term_id in enumerate(index.term_ids)}
+        for name in cls.ARRAYS:
+            setattr(index, name, arrays[name])
+        return index
+
+    @staticmethod
+    def _to_csr(rows):
+        """Turn an iterable of integer lists into CSR arrays (indptr, indices)."""
+        rows = [np.asarray(row, dtype=np.int32) for row in rows]
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(row) for row in rows])
+        indices = np.concatenate(rows) if len(rows) > 0 else np.zeros(0, dtype=np.int32)
+        return indptr, indices.astype(np.int32)
+
+    @staticmethod
+    def _transpose(indptr, indices, n_rows):
+        """Transpose a square CSR relation. Column indices of the result are sorted."""
+        rows = np.repeat(np.arange(n_rows, dtype=np.int32), np.diff(indptr))
+        order = np.argsort(indices, kind="mergesort")  # stable -> sorted row ids within each column
+        t_indptr = np.zeros(n_rows + 1, dtype=np.int64)
+        t_indptr[1:] = np.cumsum(np.bincount(indices, minlength=n_rows))
+        return t_indptr, rows[order]
+
+    def _compute_ancestor_bits(self, n_terms):
+        """
+        Compute the ancestor bitsets in topological order (parents before children).
+
+        Terms that are part of (or below) a cycle are never released by the topological
+        sort; their ancestors are collected by a breadth first search instead.
+        """
+        bits = np.zeros((n_terms, (n_terms + 7) // 8), dtype=np.uint8)
+        n_parents = np.diff(self.parent_indptr)
+        queue = deque(np.flatnonzero(n_parents == 0))
+        done = np.zeros(n_terms, dtype=bool)
+        while queue:
+            i = queue.popleft()
+            done[i] = True
+            for p in self._parents(i):
+                bits[i] |= bits[p]
+                bits[i, p >> 3] |= np.uint8(0x80 >> (p & 7))
+            for c in self._children(i):
+                n_parents[c] -= 1
+                if n_parents[c] == 0:
+                    queue.append(c)
+        for i in np.flatnonzero(~done):
+            visited = set()
+            todo = list(self._parents(i))
+            while todo:
+                p = todo.pop()
+                if p not in visited:
+                    visited.add(p)
+                    todo.extend(self._parents(p))
+            for p in visited:
+                bits[i, p >> 3] |= np.uint8(0x80 >> (p & 7))
+        return bits
+
+    def _parents(self, i):
+        return self.parent_indices[self.parent_indptr[i]:self.parent_indptr[i + 1]]
+
+    def _children(self, i):
+        return self.child_indices[self.child_indptr[i]:self.child_indptr[i + 1]]
+
+    def __len__(self):
+        return len(self.term_ids)
+
+    def __contains__(self, term_id):
+        return term_id in self.id_to_index
+
+    def index(self, term):
+        """
+        Get the integer id of a term.
+
+        Args:
+            term: obo id or OBOObject. Alternative ids are resolved through the ontology.
+        """
+        term_id = term if isinstance(term, str) else term.id
+        try:
+            return self.id_to_index[term_id]
+        except KeyError:
+            return self.id_to_index[self.obo.term(term_id).id]
+
+    def ids(self, indices):
+        """Turn an array of integer ids into a list of obo ids"""
+        return [self.term_ids[i] for i in indices]
+
+    def super_term_ids(self, term):
+        """List of obo ids of all super terms of `term`."""
+        i = self.index(term)
+        return self.ids(self.ancestor_indices[self.ancestor_indptr[i]:self.ancestor_indptr[i + 1]])
+
+    def sub_term_ids(self, term):
+        """List of obo ids of all sub terms of `term`."""
+        i = self.index(term)
+        return self.ids(self.descendant_indices[self.descendant_indptr[i]:self.descendant_indptr[i + 1]])
+
+    def parent_term_ids(self, term):
+        """List of obo ids of the direct parents of `term`."""
+        return self.ids(self._parents(self.index(term)))
+
+    def child_term_ids(self, term):
+        """List of obo ids of the direct children of `term`."""
+        return self.ids(self._children(self.index(term)))
+
+    def is_under(self, term, super_term):
+        """Return True if `super_term` is a (transitive) super term of `term`."""
+        i = self.index(term)
+        j = self.index(super_term)
+        return bool(self.ancestor_bits[i, j >> 3] & (0x80 >> (j & 7)))
+
+    def ancestor_matrix(self, terms):
+        """
+        Sparse incidence matrix of terms and their super terms.
+
+        Args:
+            terms: list of obo ids (e.g. one per sample, duplicates are allowed)
+
+        Returns:
+            scipy.sparse.csr_matrix (len(terms) x len(self)), entry (i, j) is 1 if
+                the term with integer id j is a super term of terms[i].
+        """
+        import scipy.sparse as sp
+        rows = np.array([self.index(term) for term in terms], dtype=np.int64)
+        starts = np.asarray(self.ancestor_indptr)[rows]
+        lengths = np.asarray(self.ancestor_indptr)[rows + 1] - starts
+        indptr = np.concatenate([[0], np.cumsum(lengths)])
+        positions = np.arange(indptr[-1]) - np.repeat(indptr[:-1] - starts, lengths)
+        indices = np.asarray(self.ancestor_indices)[positions]
+        return sp.csr_matrix((np.ones(len(indices), dtype=np.int32), indices, indptr), shape=(len(rows), len(self)))
+
+    def inherited_flags(self, roots):
+        """
+        Propagate flags from root terms to all their sub terms.
+
+        The flags are passed from parents to children in topological order, processing
+        all terms whose parents are done at once. Terms in (or below) a cycle are never
+        released; their flags are collected from their super terms instead.
+
+        Args:
+            roots: list of integer ids. Root k sets bit k. None entries (e.g. terms missing
+                in the ontology) set no bit.
+
+        Returns:
+            np.array (uint32) with a bitmask for every term, bit k is set if the term
+                is a (transitive) sub term of roots[k]. The roots themselves are not flagged.
+
+        >>> from pyfantom.obo import OBOOntology
+        >>> obo = OBOOntology()
+        >>> obo.load(open("test/testdata/dummy_ontology.obo"))
+        >>> idx = OntologyIndex(obo)
+        >>> idx.inherited_flags([idx.index("C"), idx.index("E")]).tolist()
+        [3, 1, 0, 0, 0, 0]
+        """
+        assert len(roots) <= 32, "at most 32 flags are supported"
+        n_terms = len(self)
+        own = np.zeros(n_terms, dtype=np.uint32)
+        for k, root in enumerate(roots):
+            if root is not None:
+                own[root] |= np.uint32(1 << k)
+        flags = np.zeros(n_terms, dtype=np.uint32)
+        n_parents = np.diff(np.asarray(self.parent_indptr))
+        child_indptr = np.asarray(self.child_indptr)
+        child_indices = np.asarray(self.child_indices)
+        done = np.zeros(n_terms, dtype=bool)
+        frontier = np.flatnonzero(n_parents == 0)
+        while len(frontier) > 0:
+            done[frontier] = True
+            starts = child_indptr[frontier]
+            lengths = child_indptr[frontier + 1] - starts
+            parents = np.repeat(frontier, lengths)
+            positions = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths - starts, lengths)
+            children = child_indices[positions]
+            np.bitwise_or.at(flags, children, flags[parents] | own[parents])
+            np.subtract.at(n_parents, children, 1)
+            frontier = np.unique(children[n_parents[children] == 0])
+        for i in np.flatnonzero(~done):
+            ancestors = self.ancestor_indices[self.ancestor_indptr[i]:self.ancestor_indptr[i + 1]]
+            flags[i] = np.bitwise_or.reduce(own[ancestors], initial=np.uint32(0))
+        return flags
+
+    def n_sub_terms(self):
+        """Array with the number of sub terms for each term (in integer id order)"""
+        return np.diff(self.descendant_indptr)
+
+    # OBOOntology compatible API.
+    def term(self, term_id):
+        return self.obo.term(term_id)
+
+    def terms(self):
+        return [self.obo.term(term_id) for term_id in self.term_ids]
+
+    def _to_terms(self, term_ids):
+        return set(self.obo.term(term_id) for term_id in term_ids)
+
+    def parent_terms(self, term):
+        return self._to_terms(self.parent_term_ids(term))
+
+    def child_terms(self, term):
+        return self._to_terms(self.child_term_ids(term))
+
+    def super_terms(self, term):
+        return self._to_terms(self.super_term_ids(term))
+
+    def sub_terms(self, term):
+        return self._to_terms(self.sub_term_ids(term))
+
+
+def super_term_ids(obo, term_id):
+    """
+    List of the ids of all super terms of `term_id`.
+
+    Args:
+        obo: OBOOntology or OntologyIndex
+        term_id: obo id
+    """
+    if isinstance(obo, OntologyIndex):
+        return obo.super_term_ids(term_id)
+    return [t.id for t in obo.super_terms(term_id)]
+
+
+def parent_term_ids(obo, term_id):
+    """
+    List of the ids of the direct parents of `term_id`.
+
+    Args:
+        obo: OBOOntology or OntologyIndex
+        term_id: obo id
+    """
+    if isinstance(obo, OntologyIndex):
+        return obo.parent_term_ids(term_id)
+    return [t.id for t in obo.parent_terms(term_id)]
+
+
+def is_under(obo, term_id, super_term_id):
+    """
+    Return True if `super_term_id` is a (transitive) super term of `term_id`.
+
+    Args:
+        obo: OBOOntology or OntologyIndex
+        term_id: obo id
+        super_term_id: obo id
+    """
+    if isinstance(obo, OntologyIndex):
+        return obo.is_under(term_id, super_term_id)
+    return super_term_id in super_term_ids(obo, term_id)
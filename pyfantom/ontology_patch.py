@@ -0,0 +1,286 @@
+"""
+Incremental corrections of an ontology.
+
+Notebook 03 corrects the ontology by adding tags to a second, fully loaded copy of the
+ontology and writing it to ff-phase2-140729.corr.obo, which is then parsed again.
+`PatchedOntology` instead applies the corrections to an `OntologyIndex` (e.g. the cached
+snapshot from `pyfantom.ontology_cache.load_ontology`) and records them in a journal:
+    * add_term(term_id, name): add a new term, e.g. the GS: meta nodes
+    * add_is_a(term_id, parent_id): add an is_a relation
+    * remove_is_a(term_id, parent_id): remove an is_a relation
+    * add_subset(term_id, subset): tag a term with a subset, e.g. `correction_gs01`
+
+The base index is not modified. Only the rows of the affected terms (the sub terms of the
+changed term for the ancestors, the super terms of the parent for the descendants) are
+recomputed and stored in an overlay. The journal is a list of dicts and can be written to
+and read from a json lines file, such that the corrections can be re-applied on the
+unmodified base ontology.
+
+Usage:
+    obo = load_ontology("../data/ff-phase2-140729.obo")
+    obo_corr = PatchedOntology(obo, read_journal("../manual_annotation/corrections.jsonl"))
+"""
+
+import json
+
+import numpy as np
+
+from pyfantom.obo import OBOTerm
+from pyfantom.ontology_index import OntologyIndex
+from pyfantom.parse_ontology import clear_time_lookup
+
+IS_A = "is_a"
+SUBSET = "subset"
+
+
+class PatchedOntology(OntologyIndex):
+    """
+    OntologyIndex with corrections applied on top of a base index.
+
+    >>> from pyfantom.obo import OBOOntology
+    >>> obo = OBOOntology()
+    >>> obo.load(open("test/testdata/dummy_ontology.obo"))
+    >>> patched = PatchedOntology(OntologyIndex(obo))
+    >>> patched.add_term("G", "G")
+    >>> patched.add_is_a("G", "D")
+    >>> patched.add_is_a("C", "G")
+    >>> patched.remove_is_a("A", "E")
+    >>> sorted(patched.super_term_ids("A")), sorted(patched.sub_term_ids("G"))
+    (['B', 'C', 'D', 'G'], ['A', 'B', 'C'])
+    >>> patched.is_under("A", "F"), patched.term("C").tags()[-1]
+    (False, ('is_a', 'G', None, 'G'))
+    >>> patched.journal[1]
+    {'op': 'add_is_a', 'term_id': 'G', 'parent_id': 'D', 'comment': 'D'}
+    >>> sorted(PatchedOntology(OntologyIndex(obo), patched.journal).super_term_ids("A"))
+    ['B', 'C', 'D', 'G']
+    """
+
+    OPERATIONS = ("add_term", "add_is_a", "remove_is_a", "add_subset")
+
+    def __init__(self, base, journal=None):
+        """
+        Args:
+            base: OntologyIndex
+            journal: list of changes to apply (see `read_journal`)
+        """
+        self.base = base
+        self.obo = base.obo
+        self.term_ids = list(base.term_ids)
+        self.id_to_index = dict(base.id_to_index)
+        self.n_base = len(base)
+        self.journal = []
+        # overlay: integer id -> sorted np.array of integer ids / list of tags
+        self._parent_rows = dict()
+        self._child_rows = dict()
+        self._ancestor_rows = dict()
+        self._descendant_rows = dict()
+        self._tags = dict()
+        self._terms = dict()
+        self._arrays = None
+        for change in journal or []:
+            self.apply(change)
+
+    def apply(self, change):
+        """
+        Apply a single change of a journal.
+
+        Args:
+            change: dict with the name of the method in 'op' and its arguments
+        """
+        change = dict(change)
+        op = change.pop("op")
+        assert op in self.OPERATIONS, "unknown operation: {}".format(op)
+        getattr(self, op)(**change)
+
+    def _row(self, i, overlay, indptr, indices):
+        if i in overlay:
+            return overlay[i]
+        if i >= self.n_base:
+            return np.zeros(0, dtype=np.int32)
+        return indices[indptr[i]:indptr[i + 1]]
+
+    def _parents(self, i):
+        return self._row(i, self._parent_rows, self.base.parent_indptr, self.base.parent_indices)
+
+    def _children(self, i):
+        return self._row(i, self._child_rows, self.base.child_indptr, self.base.child_indices)
+
+    def _ancestors(self, i):
+        return self._row(i, self._ancestor_rows, self.base.ancestor_indptr, self.base.ancestor_indices)
+
+    def _descendants(self, i):
+        return self._row(i, self._descendant_rows, self.base.descendant_indptr, self.base.descendant_indices)
+
+    def _tag_list(self, i):
+        if i not in self._tags:
+            self._tags[i] = self.base.term(self.term_ids[i]).tags()
+        return self._tags[i]
+
+    def _changed(self, change):
+        self.journal.append(change)
+        self._arrays = None
+        self._terms.clear()
+        clear_time_lookup(self)
+
+    def add_term(self, term_id, name):
+        """Add a new term without parents."""
+        assert term_id not in self, "term already exists: {}".format(term_id)
+        i = len(self.term_ids)
+        self.term_ids.append(term_id)
+        self.id_to_index[term_id] = i
+        self._tags[i] = [("id", term_id, None, None), ("name", name, None, None)]
+        self._changed({"op": "add_term", "term_id": term_id, "name": name})
+
+    def add_subset(self, term_id, subset):
+        """Add a subset tag to a term."""
+        self._tag_list(self.index(term_id)).append((SUBSET, subset, None, None))
+        self._changed({"op": "add_subset", "term_id": term_id, "subset": subset})
+
+    def add_is_a(self, term_id, parent_id, comment=None):
+        """
+        Add an is_a relation.
+
+        Args:
+            term_id: obo id of the child
+            parent_id: obo id of the parent
+            comment: comment of the tag. Defaults to the name of the parent, like in notebook 03.
+        """
+        i, p = self.index(term_id), self.index(parent_id)
+        assert i != p and not self.is_under(parent_id, term_id), \
+            "is_a {} -> {} would create a cycle".format(term_id, parent_id)
+        if comment is None:
+            comment = self.term(parent_id).name
+        self._tag_list(i).append((IS_A, parent_id, None, comment))
+        if p not in self._parents(i):
+            self._parent_rows[i] = np.union1d(self._parents(i), [p]).astype(np.int32)
+            self._child_rows[p] = np.union1d(self._children(p), [i]).astype(np.int32)
+            # the term and its sub terms gain the parent and its super terms and vice versa
+            sub_terms = np.union1d(self._descendants(i), [i]).astype(np.int32)
+            super_terms = np.union1d(self._ancestors(p), [p]).astype(np.int32)
+            for j in sub_terms:
+                self._ancestor_rows[j] = np.union1d(self._ancestors(j), super_terms).astype(np.int32)
+            for j in super_terms:
+                self._descendant_rows[j] = np.union1d(self._descendants(j), sub_terms).astype(np.int32)
+        self._changed({"op": "add_is_a", "term_id": term_id, "parent_id": parent_id, "comment": comment})
+
+    def remove_is_a(self, term_id, parent_id):
+        """
+        Remove all is_a tags of a term pointing to `parent_id`.
+
+        The edge is kept if the term is still related to the parent by a `relationship` tag.
+        """
+        i, p = self.index(term_id), self.index(parent_id)
+        tags = self._tag_list(i)
+
+        def is_parent(parent):
+            return parent in self.id_to_index and self.id_to_index[parent] == p
+
+        assert any(tag == IS_A and is_parent(value) for tag, value, _, _ in tags), \
+            "{} is not a {}".format(term_id, parent_id)
+        tags[:] = [t for t in tags if not (t[0] == IS_A and is_parent(t[1]))]
+        related = any(tag == "relationship" and is_parent(value.split(None, 1)[1]) for tag, value, _, _ in tags)
+        if not related:
+            self._parent_rows[i] = np.setdiff1d(self._parents(i), [p]).astype(np.int32)
+            self._child_rows[p] = np.setdiff1d(self._children(p), [i]).astype(np.int32)
+            self._update_ancestors(i)
+        self._changed({"op": "remove_is_a", "term_id": term_id, "parent_id": parent_id})
+
+    def _update_ancestors(self, i):
+        """Recompute the ancestors of `i` and its sub terms after removing a parent of `i`."""
+        sub_terms = [i] + self._descendants(i).tolist()
+        old_super_terms = self._ancestors(i)
+        # topological order within the sub terms: parents before children
+        in_subtree = set(sub_terms)
+        n_parents = dict((j, sum(1 for q in self._parents(j).tolist() if q in in_subtree)) for j in sub_terms)
+        todo = [j for j in sub_terms if n_parents[j] == 0]
+        while todo:
+            j = todo.pop()
+            rows = [self._ancestors(q) for q in self._parents(j).tolist()] + [self._parents(j)]
+            self._ancestor_rows[j] = np.unique(np.concatenate(rows)).astype(np.int32)
+            for c in self._children(j).tolist():
+                n_parents[c] -= 1
+                if n_parents[c] == 0:
+                    todo.append(c)
+        # only the former super terms can lose descendants
+        still_under = dict((j, []) for j in old_super_terms.tolist())
+        for k in sub_terms:
+            for j in self._ancestors(k).tolist():
+                if j in still_under:
+                    still_under[j].append(k)
+        for j, rows in still_under.items():
+            self._descendant_rows[j] = np.union1d(np.setdiff1d(self._descendants(j), sub_terms),
+                                                  rows).astype(np.int32)
+
+    def super_term_ids(self, term):
+        return self.ids(self._ancestors(self.index(term)))
+
+    def sub_term_ids(self, term):
+        return self.ids(self._descendants(self.index(term)))
+
+    def is_under(self, term, super_term):
+        i, j = self.index(term), self.index(super_term)
+        if i in self._ancestor_rows or i >= self.n_base or j >= self.n_base:
+            ancestors = self._ancestors(i)
+            k = np.searchsorted(ancestors, j)
+            return bool(k < len(ancestors) and ancestors[k] == j)
+        return self.base.is_under(term, super_term)
+
+    def term(self, term_id):
+        i = self.index(term_id)
+        if i not in self._tags:
+            return self.base.term(term_id)
+        if i not in self._terms:
+            tags = self._tags[i]
+            name = next((value for key, value, _, _ in tags if key == "name"), None)
+            self._terms[i] = OBOTerm(self.term_ids[i], name, tags)
+        return self._terms[i]
+
+    def terms(self):
+        return [self.term(term_id) for term_id in self.term_ids]
+
+    def _to_terms(self, term_ids):
+        return set(self.term(term_id) for term_id in term_ids)
+
+    def _materialize(self):
+        """CSR arrays of the patched index, see `OntologyIndex.ARRAYS`."""
+        if self._arrays is None:
+            n = len(self.term_ids)
+            arrays = dict()
+            for name, row in [("parent", self._parents), ("child", self._children),
+                              ("ancestor", self._ancestors), ("descendant", self._descendants)]:
+                arrays[name + "_indptr"], arrays[name + "_indices"] = self._to_csr(row(i) for i in range(n))
+            bits = np.zeros((n, (n + 7) // 8), dtype=np.uint8)
+            bits[:self.n_base, :self.base.ancestor_bits.shape[1]] = self.base.ancestor_bits
+            for i in set(self._ancestor_rows) | set(range(self.n_base, n)):
+                row = np.zeros(bits.shape[1] * 8, dtype=bool)
+                row[self._ancestors(i)] = True
+                bits[i] = np.packbits(row)
+            arrays["ancestor_bits"] = bits
+            self._arrays = arrays
+        return self._arrays
+
+    def to_index(self):
+        """Materialize the patched ontology into a plain OntologyIndex."""
+        return OntologyIndex.from_arrays(self, self.term_ids, self._materialize())
+
+
+def _array_property(name):
+    return property(lambda self: self._materialize()[name])
+
+
+# the arrays are only built when they are accessed directly (e.g. by dendro_tools)
+for _name in OntologyIndex.ARRAYS:
+    setattr(PatchedOntology, _name, _array_property(_name))
+
+
+def write_journal(journal, filename):
+    """Write a journal of changes as json lines."""
+    with open(filename, 'w') as f:
+        for change in journal:
+            f.write(json.dumps(change) + "\n")
+
+
+def read_journal(filename):
+    """Read a journal written by `write_journal`."""
+    with open(filename) as f:
+        return [json.loads(line) for line in f if line.strip()]
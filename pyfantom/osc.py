@@ -0,0 +1,191 @@
+import re
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+from pyfantom.parse_ontology import process_sample_names
+
+COLUMN_VARIABLE_REGEX = re.compile(r'^##ColumnVariables\[(.+?)\]=(.*)$')
+# column names of the expression values start with this prefix
+SAMPLE_PREFIX = "tpm."
+# the first rows of the table contain statistics (e.g. 01STAT:MAPPED) rather than CAGE peaks
+STAT_ROW_REGEX = r'^\d+STAT:'
+
+OSCHeader = namedtuple("OSCHeader", ["column_vars", "columns", "n_comment_lines"])
+
+
+def read_column_variables(file):
+    """
+    Parse the `##ColumnVariables` header of an OSC file.
+
+    Reading stops at the first line that does not start with '#'.
+
+    Args:
+        file: file object of the OSC table
+
+    Returns:
+        OrderedDict column name -> column description
+
+    >>> column_vars = read_column_variables(open("test/testdata/dummy.osc.txt"))
+    >>> list(column_vars.items())[1]
+    ('short_description', 'short form of the description below. Common descriptions in the long descriptions has been omited')
+    """
+    return _read_comment_lines(file)[0]
+
+
+def _read_comment_lines(file):
+    """
+    Read the comment lines at the top of an OSC table.
+
+    Returns:
+        column variables, number of comment lines, the first line after the comments (None at the end of the file)
+    """
+    column_vars = OrderedDict()
+    n_comment_lines = 0
+    for line in file:
+        if not line.startswith("#"):
+            return column_vars, n_comment_lines, line
+        n_comment_lines += 1
+        match = COLUMN_VARIABLE_REGEX.match(line.rstrip("\n"))
+        if match is not None:
+            column_vars[match.group(1)] = match.group(2)
+    return column_vars, n_comment_lines, None
+
+
+def get_sample_infos(column_vars):
+    """
+    Get the sample descriptions (= the lines of column_vars.txt) from the column variables.
+
+    >>> column_vars = read_column_variables(open("test/testdata/dummy.osc.txt"))
+    >>> get_sample_infos(column_vars)[:2]
+    ['tpm of Adipocyte - breast, donor1.CNhs11051.11376-118A8', 'tpm of Adipocyte - breast, donor2.CNhs11969.11327-117E4']
+    """
+    return [desc for name, desc in column_vars.items() if name.startswith(SAMPLE_PREFIX)]
+
+
+def read_osc_header(filename):
+    """
+    Read the header of an OSC table without touching the data rows.
+
+    Returns:
+        OSCHeader: the column variables, the column names of the table and
+            the number of comment lines preceding the column names.
+
+    Raises:
+        ValueError: if the file contains no line with column names
+
+    >>> header = read_osc_header("test/testdata/dummy.osc.txt")
+    >>> header.columns[:3], header.n_comment_lines
+    (['00Annotation', 'short_description', 'description'], 15)
+    """
+    with open(filename) as f:
+        column_vars, n_comment_lines, line = _read_comment_lines(f)
+    if line is None:
+        raise ValueError("no column names in OSC table: {}".format(filename))
+    return OSCHeader(column_vars, line.rstrip("\n").split("\t"), n_comment_lines)
+
+
+def get_sample_annotation(header):
+    """
+    Parse the sample descriptions from the OSC header into a sample annotation.
+
+    Args:
+        header: OSCHeader
+
+    Returns:
+        pd.DataFrame with the columns of `process_sample_names` and the
+            column name of the sample in the OSC table. The rows are in the order of the table.
+
+    >>> annot = get_sample_annotation(read_osc_header("test/testdata/dummy.osc.txt"))
+    >>> annot[["lib_id", "obo_id", "donor", "tech_rep"]].head(4)
+          lib_id          obo_id   donor   tech_rep
+    0  CNhs11051  FF:11376-118A8  donor1       None
+    1  CNhs11969  FF:11327-117E4  donor2       None
+    2  CNhs12588  FF:12225-129F2  donor1  tech_rep1
+    3  CNhs12553  FF:12225-129F2  donor1  tech_rep2
+    """
+    sample_columns = [col for col in header.columns if col.startswith(SAMPLE_PREFIX)]
+    annotation = process_sample_names([header.column_vars[col] for col in sample_columns])
+    return annotation.assign(column=sample_columns)
+
+
+def _select_samples(header, samples):
+    """Turn a sample selection (mask, positions or library ids) into a list of column names"""
+    sample_columns = [col for col in header.columns if col.startswith(SAMPLE_PREFIX)]
+    if samples is None:
+        return sample_columns
+    samples = np.asarray(samples)
+    if samples.dtype == bool:
+        assert len(samples) == len(sample_columns), "sample mask does not match the number of samples"
+        positions = np.flatnonzero(samples)
+    elif np.issubdtype(samples.dtype, np.integer):
+        positions = np.unique(samples)
+    else:
+        lib_to_pos = {lib_id: i for i, lib_id in enumerate(get_sample_annotation(header).lib_id)}
+        positions = np.unique([lib_to_pos[lib_id] for lib_id in samples])
+    return [sample_columns[i] for i in positions]
+
+
+def iter_osc_chunks(filename, samples=None, chunk_size=10000, annotation_columns=None):
+    """
+    Stream the data rows of an OSC table in chunks.
+
+    Only the selected sample columns are parsed, so that peak memory is bounded by
+    `chunk_size` x number of selected samples. The statistics rows at the
+    beginning of the table are skipped.
+
+    Args:
+        filename: path to the OSC table
+        samples: selection of sample columns. Either None (all samples), a boolean mask,
+            integer positions or library ids. The columns are always returned in the
+            order of the table.
+        chunk_size: number of rows per chunk
+        annotation_columns: feature annotation columns to read (default: all non-sample columns)
+
+    Yields:
+        (fdata, exprs): pd.DataFrame with the peak annotation indexed by the peak id and
+            a float32 numpy array (peaks x selected samples)
+
+    >>> tissue = [False, False, False, False, True, True, False]
+    >>> for fdata, exprs in iter_osc_chunks("test/testdata/dummy.osc.txt", samples=tissue, chunk_size=5):
+    ...     print(list(fdata.short_description), exprs.dtype, exprs.shape)
+    ['p1@GENEA', 'p2@GENEA', 'p1@GENEB'] float32 (3, 2)
+    ['p@chr3:500..520,+', 'p1@GENEC', 'p3@GENEA', 'p2@GENEB', 'p1@GENED'] float32 (5, 2)
+    """
+    header = read_osc_header(filename)
+    if annotation_columns is None:
+        annotation_columns = [col for col in header.columns if not col.startswith(SAMPLE_PREFIX)]
+    selected = _select_samples(header, samples)
+    index_col = header.columns[0]
+    usecols = [index_col] + [col for col in annotation_columns if col != index_col] + selected
+
+    reader = pd.read_csv(filename, sep="\t", skiprows=header.n_comment_lines, usecols=usecols,
+                         index_col=index_col, dtype=dict((col, np.float32) for col in selected),
+                         chunksize=chunk_size)
+    for chunk in reader:
+        chunk = chunk[~chunk.index.str.contains(STAT_ROW_REGEX)]
+        if len(chunk) == 0:
+            continue
+        yield chunk[[col for col in usecols[1:] if col not in selected]], chunk[selected].values
+
+
+def read_osc_matrix(filename, samples=None, chunk_size=10000, annotation_columns=None):
+    """
+    Read the expression values of the selected samples from an OSC table.
+
+    Wrapper for `iter_osc_chunks`, the chunks are concatenated.
+
+    Returns:
+        (fdata, exprs), see iter_osc_chunks
+
+    >>> fdata, exprs = read_osc_matrix("test/testdata/dummy.osc.txt", samples=["CNhs11051", "CNhs11969"])
+    >>> exprs.shape, fdata.index[0]
+    ((8, 2), 'chr1:100..120,+')
+    """
+    fdata_chunks = []
+    exprs_chunks = []
+    for fdata, exprs in iter_osc_chunks(filename, samples, chunk_size, annotation_columns):
+        fdata_chunks.append(fdata)
+        exprs_chunks.append(exprs)
+    return pd.concat(fdata_chunks), np.vstack(exprs_chunks)
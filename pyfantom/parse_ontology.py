@@ -1,7 +1,7 @@
 import re
-from orangecontrib.bio.ontology import OBOOntology
-import itertools
 import logging
+import weakref
+from collections import namedtuple
 from pprint import pprint
 
 # The IDs from the ontology file
@@ -10,6 +10,22 @@ BIOL_REP = "EFO:0002091"
 HOUR_TERM = "UO:0000032"
 MINUTE_TERM = "UO:0000031"
 DAY_TERM = "UO:0000033"
+# sample types, a sample belongs to a type if it is a descendant of the term
+SAMPLE_TYPE_TERMS = {
+    "FF:0000002": "primary cell",
+    "FF:0000004": "tissue",
+    "FF:0000003": "cell line",
+}
+
+# Regular expressions for parsing the column headers
+OBO_ID_REGEX = re.compile(r'CNhs\d+.(\w+)-(\w+)')
+LIB_ID_REGEX = re.compile(r'CNhs(\d+)')
+TIME_REGEX = re.compile(r'(\d+)(hr|min)|day(\d+)')
+INT_REGEX = re.compile(r'(\d+)')
+DONOR_REGEX = re.compile(r'donor(\d+)')
+BIOL_REPLICATE_REGEX = re.compile(r'([ ]+|biol_)rep(\d+)')
+TECH_REPLICATE_REGEX = re.compile(r'tech_rep(\d+)')
+SAMPLE_ID_REGEX = re.compile(r'FF:(.{5})-(.{5})')
 
 
 def get_rex_value(regex, str):
@@ -33,7 +49,6 @@ def get_obo_id(str):
     >>> get_obo_id("tpm of 293SLAM rinderpest infection, 00hr, biol_rep1.CNhs14406.13541-145H4")
     'FF:13541-145H4'
     """
-    OBO_ID_REGEX = re.compile(r'CNhs\d+.(\w+)-(\w+)')
     return "FF:" + "-".join(OBO_ID_REGEX.search(str).groups())
 
 
@@ -46,7 +61,6 @@ def get_lib_id(str):
     >>> get_lib_id("tpm of 293SLAM rinderpest infection, 00hr, biol_rep1.CNhs14406.13541-145H4")
     'CNhs14406'
     """
-    LIB_ID_REGEX = re.compile(r'CNhs(\d+)')
     return LIB_ID_REGEX.search(str).group()
 
 
@@ -68,8 +82,6 @@ def get_time(str):
     '01hr40min'
     """
     time = {"hr": None, "min": None, "day": None}
-    TIME_REGEX = re.compile(r'(\d+)(hr|min)|day(\d+)')
-    INT_REGEX = re.compile(r'(\d+)')
     for match_obj in TIME_REGEX.finditer(str):
         time_str = match_obj.group()
         for unit in time:
@@ -118,7 +130,6 @@ def get_donor(str):
     >>> get_donor("tpm of 293SLAM rinderpestdayd01 infection, 00hr, dondor1, biol_rep1.CNhs14406.13541-145H4")
 
     """
-    DONOR_REGEX = re.compile(r'donor(\d+)')
     return get_rex_value(DONOR_REGEX, str)
 
 
@@ -136,8 +147,7 @@ def get_biol_replicate(str):
     >>> get_biol_replicate("tpm of 293SLAM rinderpestdayd01 infection, 00hr, donor1, some_rep1.CNhs14406.13541-145H4")
 
     """
-    REPLICATE_REGEX = re.compile(r'([ ]+|biol_)rep(\d+)')
-    rep = get_rex_value(REPLICATE_REGEX, str)
+    rep = get_rex_value(BIOL_REPLICATE_REGEX, str)
     if rep is not None:
         rep = rep.strip()
     return rep
@@ -152,8 +162,7 @@ def get_tech_replicate(str):
     >>> get_tech_replicate("tpm of 293SLAM rinderpestdayd01 infection, 00hr, donor1, rep1.CNhs14406.13541-145H4")
 
     """
-    REPLICATE_REGEX = re.compile(r'tech_rep(\d+)')
-    return get_rex_value(REPLICATE_REGEX, str)
+    return get_rex_value(TECH_REPLICATE_REGEX, str)
 
 
 def contains_term(term, tag_name, tag_value):
@@ -161,17 +170,92 @@ def contains_term(term, tag_name, tag_value):
     return any(a == tag_name and b == tag_value for a, b in term.tags())
 
 
+TimeTerms = namedtuple("TimeTerms", ["hour_terms", "minute_terms", "day_terms", "term_time"])
+
+# memoized time terms per ontology, see get_time_lookup
+_TIME_TERM_CACHE = weakref.WeakKeyDictionary()
+
+
+def _relations_version(obo):
+    """
+    Cheap fingerprint of the relations of a mutable (orange) OBOOntology: the number of objects and
+    the relation cache, which orange rebuilds (as a new dict) after `add_object`, `update` etc.
+    None for the native OBOOntology and OntologyIndex, which cannot be modified in place.
+    """
+    if not hasattr(obo, "_cache_validate"):
+        return None
+    obo._cache_validate()
+    return len(obo.objects), obo._related_to
+
+
+def get_time_lookup(obo):
+    """
+    Get the time terms of an ontology.
+
+    The child terms of HOUR_TERM, MINUTE_TERM and DAY_TERM are only retrieved once per
+    ontology and memoized (keyed by the identity of `obo`). An orange OBOOntology that is
+    modified in place (`add_object` in notebook 03) is detected by its number of objects and
+    its relation cache, the entry is rebuilt then. `PatchedOntology` clears its entry on every
+    change. Tags added to existing terms (`add_tag`) are not seen by orange's `child_terms`
+    either until it rebuilds its relation cache (`obo._cache_validate(force=True)`), which
+    also rebuilds the entry. `clear_time_lookup(obo)` discards an entry explicitly.
+
+    Args:
+        obo: OBOOntology or OntologyIndex
+
+    Returns:
+        TimeTerms: frozensets of the hour, minute and day term ids and
+            a dict mapping each time term id to its readable time string.
+
+    >>> from pyfantom.obo import OBOOntology
+    >>> obo = OBOOntology()
+    >>> obo.load(open("test/testdata/ff-phase2-140729.obo"))
+    >>> get_time_lookup(obo).term_time["FF:0000357"]
+    '00hr'
+    >>> get_time_lookup(obo) is get_time_lookup(obo)
+    True
+    """
+    version = _relations_version(obo)
+    cached = _TIME_TERM_CACHE.get(obo)
+    if cached is not None and (version is None or (cached[0][0] == version[0] and cached[0][1] is version[1])):
+        return cached[1]
+    time_terms = _build_time_lookup(obo)
+    _TIME_TERM_CACHE[obo] = (version, time_terms)
+    return time_terms
+
+
+def clear_time_lookup(obo=None):
+    """Discard the memoized time terms of `obo` (or of all ontologies if obo is None)"""
+    if obo is None:
+        _TIME_TERM_CACHE.clear()
+    else:
+        _TIME_TERM_CACHE.pop(obo, None)
+
+
+def _build_time_lookup(obo):
+    NO_REGEX = re.compile(r'(\d+)')
+    hour_terms = frozenset(term.id for term in obo.child_terms(HOUR_TERM))
+    minute_terms = frozenset(term.id for term in obo.child_terms(MINUTE_TERM))
+    day_terms = frozenset(term.id for term in obo.child_terms(DAY_TERM))
+    term_time = dict()
+    for terms, unit in [(day_terms, "day"), (minute_terms, "min"), (hour_terms, "hr")]:
+        for term_id in terms:
+            time_dict = {"hr": None, "min": None, "day": None}
+            time_dict[unit] = NO_REGEX.search(obo.term(term_id).name).group()
+            term_time[term_id] = time_dict_to_str(time_dict)
+    return TimeTerms(hour_terms, minute_terms, day_terms, term_time)
+
+
 def get_time_terms(obo):
-    hour_terms = [term.id for term in obo.child_terms(HOUR_TERM)]
-    minute_terms = [term.id for term in obo.child_terms(MINUTE_TERM)]
-    day_terms = [term.id for term in obo.child_terms(DAY_TERM)]
-    return hour_terms, minute_terms, day_terms
+    time_terms = get_time_lookup(obo)
+    return time_terms.hour_terms, time_terms.minute_terms, time_terms.day_terms
 
 
 def is_time_term(obo, term_id):
     """
     Return true if the term_id is a time-ontology
 
+    >>> from pyfantom.obo import OBOOntology
     >>> obo = OBOOntology()
     >>> obo.load(open("test/testdata/ff-phase2-140729.obo"))
     >>> is_time_term(obo, "FF:0000357")
@@ -179,31 +263,31 @@ def is_time_term(obo, term_id):
     >>> is_time_term(obo, "FF:0350357")
     False
     """
-    return True if term_id in itertools.chain(*get_time_terms(obo)) else False
+    return term_id in get_time_lookup(obo).term_time
 
 
 def ontology_to_time(obo, obo_id):
     """
     Convert an ontology id to a readable time string.
 
+    Raises:
+        KeyError: if obo_id is not a time term (see `is_time_term`)
+
+    >>> from pyfantom.obo import OBOOntology
     >>> obo = OBOOntology()
     >>> obo.load(open("test/testdata/ff-phase2-140729.obo"))
     >>> ontology_to_time(obo, "FF:0000357")
     '00hr'
+    >>> ontology_to_time(obo, "FF:0000002")
+    Traceback (most recent call last):
+    ...
+    KeyError: 'not a time term: FF:0000002'
 
     """
-    hour_terms, minute_terms, day_terms = get_time_terms(obo)
-    NO_REGEX = re.compile(r'(\d+)')
-    term = obo.term(obo_id)
-    number = NO_REGEX.search(term.name).group()
-    time_dict = {"hr": None, "min": None, "day": None}
-    if obo_id in hour_terms:
-        time_dict['hr'] = number
-    elif obo_id in minute_terms:
-        time_dict['min'] = number
-    elif obo_id in day_terms:
-        time_dict['day'] = number
-    return time_dict_to_str(time_dict)
+    term_time = get_time_lookup(obo).term_time
+    if obo_id not in term_time:
+        raise KeyError("not a time term: {}".format(obo_id))
+    return term_time[obo_id]
 
 
 def get_sample_type_from_ontology(obo, obo_term):
@@ -216,12 +300,13 @@ def get_sample_type_from_ontology(obo, obo_term):
     There are certain cases which are not unique. Thus a list of the associated types is returned.
 
     Args:
-        obo: OBOOntology Object
+        obo: OBOOntology Object or OntologyIndex
         obo_term: OBOObject (term)
 
     Returns:
         List containing None/primary cell/tissue/cell line
 
+    >>> from pyfantom.obo import OBOOntology
     >>> obo = OBOOntology()
     >>> obo.load(open("test/testdata/ff-phase2-140729.obo"))
     >>> obo_term = obo.term("FF:10100-102D1")  # tpm of uterus, adult, pool1.CNhs1167...
@@ -230,20 +315,75 @@ def get_sample_type_from_ontology(obo, obo_term):
     >>> obo_term = obo.term("FF:11931-125I5") # not unique
     >>> sorted(get_sample_type_from_ontology(obo, obo_term))
     ['primary cell', 'tissue']
+    >>> from pyfantom.ontology_index import OntologyIndex
+    >>> sorted(get_sample_type_from_ontology(OntologyIndex(obo), obo_term))
+    ['primary cell', 'tissue']
     """
-    mapping = {
-        "FF:0000002": "primary cell",
-        "FF:0000004": "tissue",
-        "FF:0000003": "cell line",
-    }
-    super_terms = [term.id for term in obo.super_terms(obo_term.id)]
+    from pyfantom.ontology_index import is_under
+    mapping = SAMPLE_TYPE_TERMS
     sample_type = []  # cases like FF:11931-125I5 which are not unique
     for key, val in mapping.items():
-        if key in super_terms:
+        if is_under(obo, obo_term.id, key):
             sample_type.append(val)
     return sample_type
 
 
+def sample_type_bits(obo):
+    """
+    Bitmask of the sample types of all terms.
+
+    Bit k is set if the term is a sub term of the k-th term of SAMPLE_TYPE_TERMS, see
+    `OntologyIndex.inherited_flags`.
+
+    Args:
+        obo: OntologyIndex
+
+    Returns:
+        np.array (uint32) in integer id order of the index
+    """
+    roots = [obo.index(term_id) if term_id in obo else None for term_id in SAMPLE_TYPE_TERMS]
+    return obo.inherited_flags(roots)
+
+
+def get_sample_types(obo):
+    """
+    Get the sample type of every sample term (FF:?????-?????) of the ontology at once.
+
+    Replacement for calling `get_sample_type_from_ontology` for every sample. The bitmask
+    is taken from the snapshot of `pyfantom.ontology_cache.load_ontology`, if available.
+
+    Args:
+        obo: OBOOntology Object or OntologyIndex
+
+    Returns:
+        pd.Series obo_id -> primary cell/tissue/cell line, 'multiple' if the sample belongs
+            to more than one type and None if it belongs to none.
+
+    >>> from pyfantom.obo import OBOOntology
+    >>> obo = OBOOntology()
+    >>> obo.load(open("test/testdata/ff-phase2-140729.obo"))
+    >>> sample_types = get_sample_types(obo)
+    >>> sample_types["FF:10100-102D1"], sample_types["FF:11931-125I5"]
+    ('tissue', 'multiple')
+    >>> sample_types.value_counts().to_dict()
+    {'cell line': 890, 'primary cell': 888, 'tissue': 235, 'multiple': 37}
+    """
+    import numpy as np
+    import pandas as pd
+    from pyfantom.ontology_index import OntologyIndex
+    index = obo if isinstance(obo, OntologyIndex) else OntologyIndex(obo)
+    bits = getattr(index, "sample_type_bits", None)
+    if bits is None:
+        bits = sample_type_bits(index)
+    labels = np.full(1 << len(SAMPLE_TYPE_TERMS), "multiple", dtype=object)
+    labels[0] = None
+    for k, sample_type in enumerate(SAMPLE_TYPE_TERMS.values()):
+        labels[1 << k] = sample_type
+    is_sample = np.array([SAMPLE_ID_REGEX.match(term_id) is not None for term_id in index.term_ids])
+    return pd.Series(labels[np.asarray(bits)[is_sample]], index=pd.Index(np.array(index.term_ids)[is_sample],
+                                                                         name="obo_id"), name="sample_type")
+
+
 def process_sample_name(sample_info):
     """
     Extract sample information from the sample name.
@@ -278,13 +418,98 @@ def process_sample_name(sample_info):
     return info_n
 
 
+def process_sample_names(sample_infos):
+    """
+    Vectorized version of `process_sample_name` for a list of column headers.
+
+    The same assertions as in `process_sample_name` and `get_time` are checked, the
+    error messages list the indices of all offending rows.
+
+    Args:
+        sample_infos: list or pandas Series of column headers (e.g. from column_vars.txt)
+
+    Returns:
+        pd.DataFrame with one row per sample and the same columns as the
+        dictionary returned by `process_sample_name`.
+
+    >>> df = process_sample_names([
+    ...     "tpm of 293SLAM rinderpest infection, 00hr, biol_rep1.CNhs14406.13541-145H4",
+    ...     "tpm of occipital lobe, fetal, donor1.CNhs11784.10073-102A1"])
+    >>> df[["obo_id", "lib_id", "donor", "biol_rep", "tech_rep", "time"]]
+               obo_id     lib_id   donor   biol_rep tech_rep  time
+    0  FF:13541-145H4  CNhs14406    None  biol_rep1     None  00hr
+    1  FF:10073-102A1  CNhs11784  donor1       None     None  None
+    >>> process_sample_names(["tpm of A, day01, day02.CNhs1.1-1", "tpm of B, 1hr.CNhs2.2-2"])
+    Traceback (most recent call last):
+    ...
+    AssertionError: multiple times per unit day not allowed in rows [0]
+    """
+    import pandas as pd
+    names = pd.Series(sample_infos, dtype=object)
+    if not isinstance(sample_infos, pd.Series):
+        names.index = pd.RangeIndex(len(names))
+
+    obo_id = names.str.extract(OBO_ID_REGEX, expand=True)
+    lib_id = _extract_match(names, LIB_ID_REGEX)
+    missing = obo_id.isnull().any(axis=1) | lib_id.isnull()
+    assert not missing.any(), "could not parse obo or library id in rows {}".format(names.index[missing].tolist())
+
+    info_n = pd.DataFrame({
+        "biol_rep": _extract_match(names, BIOL_REPLICATE_REGEX).str.strip(),
+        "donor": _extract_match(names, DONOR_REGEX),
+        "lib_id": lib_id,
+        "name_orig": names,
+        "obo_id": "FF:" + obo_id[0] + "-" + obo_id[1],
+        "tech_rep": _extract_match(names, TECH_REPLICATE_REGEX),
+        "time": _get_times(names),
+    }, index=names.index, columns=["biol_rep", "donor", "lib_id", "name_orig", "obo_id", "tech_rep", "time"])
+    info_n = info_n.astype(object).where(info_n.notnull(), None)
+
+    both = info_n.biol_rep.notnull() & info_n.donor.notnull()
+    assert not both.any(), \
+        "as donor is a form of biological replicate they should not co-occur in a name: rows {}".format(
+            names.index[both].tolist())
+    return info_n
+
+
+def _extract_match(names, regex):
+    """Vectorized `get_rex_value`: the first match of regex in each element of a Series, NaN if none."""
+    return names.str.extract("(" + regex.pattern + ")", expand=True)[0]
+
+
+def _get_times(names):
+    """Vectorized `get_time` for a Series of column headers"""
+    import numpy as np
+    import pandas as pd
+    times = np.full(len(names), np.nan, dtype=object)
+    # the matches are keyed by position, the index of names may contain duplicates
+    matches = names.reset_index(drop=True).str.extractall(TIME_REGEX)
+    if len(matches) > 0:
+        matches = pd.DataFrame({
+            "row": matches.index.get_level_values(0),
+            "unit": matches[1].fillna("day").values,
+            "value": matches[0].fillna(matches[2]).astype(int).values,
+        })
+        duplicated = matches[matches.duplicated(["row", "unit"])]
+        for unit, rows in duplicated.groupby("unit").row:
+            raise AssertionError("multiple times per unit {} not allowed in rows {}".format(
+                unit, names.index[rows.unique()].tolist()))
+
+        by_unit = matches.pivot(index="row", columns="unit", values="value").reindex(columns=["day", "hr", "min"])
+        day, hr, minute = [by_unit[unit].dropna().astype(int).map(fmt.format).reindex(by_unit.index, fill_value="")
+                           for unit, fmt in [("day", "day{:02d}"), ("hr", "{:02d}hr"), ("min", "{:02d}min")]]
+        sep = np.where((day != "") & ((hr != "") | (minute != "")), ";", "")
+        times[by_unit.index.values] = (day + sep + hr + minute).values
+    return pd.Series(times, index=names.index)
+
+
 def process_sample_ontology(obo, sample_info):
     """
      loops through all is_a relationships in tags and look if it contains any relevant annotation.
      Here, we extract the time and whether the sample is a biological or technical replicate.
 
      Args:
-         obo: OBOOntology Object
+         obo: OBOOntology Object or OntologyIndex
          obo_term: OBOObject (term)
 
      Returns:
@@ -292,6 +517,7 @@ def process_sample_ontology(obo, sample_info):
          tech_rep_o: True, if the sample is a technical replicate, else None
          biol_rep_o, True, if the sample is a biological replicate, else None
 
+    >>> from pyfantom.obo import OBOOntology
     >>> obo = OBOOntology()
     >>> obo.load(open("test/testdata/ff-phase2-140729.obo"))
     >>> sample_info = "tpm of occipital lobe, fetal, donor1.CNhs11784.10073-102A1"
@@ -345,6 +571,7 @@ def merge_sample_info(info_n, info_o, info_si, annot_notes=[]):
     Returns:
         annot, dict with the merged annotations
 
+    >>> from pyfantom.obo import OBOOntology
     >>> obo = OBOOntology()
     >>> obo.load(open("test/testdata/ff-phase2-140729.obo"))
     >>> sample_info = "tpm of 293SLAM rinderpest infection, 00hr, biol_rep1.CNhs14406.13541-145H4"
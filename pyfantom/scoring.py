@@ -0,0 +1,156 @@
+"""
+Rank based scoring of signatures in samples, like BioQC.
+
+For every sample, the genes of a signature are compared to all other genes with a
+Wilcoxon-Mann-Whitney test. Every sample (column of the expression matrix) is ranked once;
+the rank sums of all signatures are a single sparse matrix product of the signature x gene
+incidence matrix with the ranks. The samples are processed in chunks on a thread pool.
+
+Usage:
+    scorer = SignatureScorer(fdata.gene_symbol, GMTStore(glob.glob("../gmt/*.gmt")))
+    scores = scorer.score(exprs)
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.stats import norm
+
+from pyfantom.gmt import GMTStore
+
+VALUES = ("score", "pvalue", "statistic")
+
+
+def average_ranks(values):
+    """
+    Rank the columns of a matrix, ties get the average rank (like scipy.stats.rankdata(values, axis=0)).
+
+    The columns are sorted as rows of the transposed matrix, and the tied groups of all columns
+    are found at once on the flattened sorted values.
+
+    >>> average_ranks(np.array([[1., 3.], [2., 3.], [2., 1.]]))
+    array([[1. , 2.5],
+           [2.5, 2.5],
+           [2.5, 1. ]])
+    """
+    values = np.ascontiguousarray(np.asarray(values).T)
+    n = values.shape[1]
+    order = np.argsort(values, axis=1)
+    sorted_values = np.take_along_axis(values, order, axis=1)
+    # the first element of every row starts a new group
+    new_group = np.ones(values.shape, dtype=bool)
+    new_group[:, 1:] = sorted_values[:, 1:] != sorted_values[:, :-1]
+    starts = np.flatnonzero(new_group)
+    ends = np.append(starts[1:], new_group.size)
+    group_ranks = (starts + ends + 1) / 2 - (starts // n) * n
+    ranks = np.empty(values.shape)
+    np.put_along_axis(ranks, order, np.repeat(group_ranks, ends - starts).reshape(values.shape), axis=1)
+    return ranks.T
+
+
+class SignatureScorer:
+    """
+    Wilcoxon-Mann-Whitney test of signatures x samples.
+
+    The p-values use the normal approximation of the U statistic (without tie and continuity
+    correction, like BioQC's wmwTest). The score is the absolute log10 of the one-sided
+    p-value ('greater', the genes of the signature are higher expressed than the rest), as
+    in pygenesig's BioQCSignatureTester.
+
+    >>> exprs = np.array([[5., 1.], [4., 2.], [3., 3.], [2., 4.], [1., 5.]])
+    >>> scorer = SignatureScorer(["a", "b", "c", "d", "e"], {"ab": ["a", "b"], "de": ["d", "e", "x"]})
+    >>> scorer.n_genes.tolist()
+    [2, 2]
+    >>> scorer.score(exprs, value="statistic")
+          0    1
+    ab  6.0  0.0
+    de  0.0  6.0
+    >>> scorer.score(exprs, value="pvalue").round(3)
+            0      1
+    ab  0.042  0.958
+    de  0.958  0.042
+    """
+
+    def __init__(self, genes, signatures):
+        """
+        Args:
+            genes: gene symbol of each row of the expression matrix
+            signatures: GMTStore or dict signature name -> list of genes.
+                Genes that are not in `genes` are ignored.
+        """
+        genes = list(genes)
+        self.gene_index = dict((gene, i) for i, gene in enumerate(genes))
+        assert len(self.gene_index) == len(genes), "the gene symbols are not unique"
+        self.n_rows = len(genes)
+        if isinstance(signatures, GMTStore):
+            names = signatures.signatures.index
+            gene_lists = [signatures.genes(source, name) for source, name in names]
+        else:
+            names = pd.Index(list(signatures))
+            gene_lists = list(signatures.values())
+        self.names = names
+        rows = [sorted(set(self.gene_index[gene] for gene in gene_list if gene in self.gene_index))
+                for gene_list in gene_lists]
+        self.n_genes = np.array([len(row) for row in rows])
+        indptr = np.concatenate([[0], np.cumsum(self.n_genes)])
+        indices = np.array([i for row in rows for i in row], dtype=np.int32)
+        self.matrix = sp.csr_matrix((np.ones(len(indices)), indices, indptr), shape=(len(rows), self.n_rows))
+
+    def _score_chunk(self, exprs, columns, out, value):
+        ranks = average_ranks(exprs[:, columns])
+        n1 = self.n_genes[:, np.newaxis].astype(np.float64)
+        n2 = self.n_rows - n1
+        statistic = self.matrix.dot(ranks) - n1 * (n1 + 1) / 2
+        if value == "statistic":
+            out[:, columns] = statistic
+            return
+        with np.errstate(invalid="ignore", divide="ignore"):
+            z = (statistic - n1 * n2 / 2) / np.sqrt(n1 * n2 * (self.n_rows + 1) / 12)
+        if value == "pvalue":
+            out[:, columns] = norm.sf(z)
+        else:
+            out[:, columns] = -norm.logsf(z) / np.log(10)
+
+    def score(self, exprs, value="score", chunk_size=100, n_jobs=None):
+        """
+        Score all signatures in all samples.
+
+        Args:
+            exprs: matrix (genes x samples), may be a numpy memmap
+            value: 'score' (abs. log10 p-value), 'pvalue' or 'statistic' (Mann-Whitney U)
+            chunk_size: number of samples ranked at once
+            n_jobs: number of threads (default: see ThreadPoolExecutor)
+
+        Returns:
+            pd.DataFrame (signatures x samples). Signatures without genes in the
+                expression matrix are NaN.
+        """
+        assert value in VALUES, "unknown value: {}".format(value)
+        assert exprs.shape[0] == self.n_rows, "number of rows does not match the number of genes"
+        out = np.empty((len(self.names), exprs.shape[1]))
+        chunks = [slice(start, start + chunk_size) for start in range(0, exprs.shape[1], chunk_size)]
+        with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+            # list() to raise the exceptions of the workers
+            list(pool.map(lambda columns: self._score_chunk(exprs, columns, out, value), chunks))
+        out[self.n_genes == 0, :] = np.nan
+        return pd.DataFrame(out, index=self.names)
+
+
+def score_signatures(exprs, genes, signatures, value="score", chunk_size=100, n_jobs=None):
+    """
+    Score signatures in samples, see `SignatureScorer`.
+
+    Args:
+        exprs: matrix (genes x samples)
+        genes: gene symbol of each row of exprs
+        signatures: GMTStore or dict signature name -> list of genes
+        value: 'score', 'pvalue' or 'statistic'
+        chunk_size: number of samples ranked at once
+        n_jobs: number of threads
+
+    Returns:
+        pd.DataFrame (signatures x samples)
+    """
+    return SignatureScorer(genes, signatures).score(exprs, value, chunk_size, n_jobs)
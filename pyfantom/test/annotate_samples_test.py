@@ -0,0 +1,29 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import pandas as pd
+
+from pyfantom.annotate_samples import main
+
+
+class TestAnnotateSamples(TestCase):
+
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.out_dir)
+
+    def test_main(self):
+        # without the supplementary table, all columns but the sample type must be equal to notebook 01
+        main(["--header", "testdata/column_vars.txt", "--obo", "testdata/ff-phase2-140729.obo",
+              "--out-dir", self.out_dir, "--cache-dir", os.path.join(self.out_dir, "cache"), "--jobs", "2"])
+        expected = pd.read_csv("testdata/column_vars.processed.csv", index_col=0)
+        annotations = pd.read_csv(os.path.join(self.out_dir, "column_vars.processed.csv"), index_col=0)
+        self.assertEqual(list(expected.columns), list(annotations.columns))
+        pd.testing.assert_frame_equal(expected.drop(columns="sample_type"), annotations.drop(columns="sample_type"))
+        annot_notes = pd.read_csv(os.path.join(self.out_dir, "annotation_notes.csv"), index_col=0)
+        self.assertEqual(["lib_id", "obo_id", "field_name", "new_value"], list(annot_notes.columns))
+        self.assertTrue(set(annot_notes.lib_id) <= set(expected.lib_id))
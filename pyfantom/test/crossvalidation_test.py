@@ -0,0 +1,49 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from pyfantom.crossvalidation import cross_validate, group_folds
+
+
+def top_genes(exprs, target, n_genes=5):
+    """signature: the genes with the highest difference between the mean of a class and the mean of the others"""
+    signatures = dict()
+    for label in set(target):
+        in_class = target == label
+        diff = exprs[:, in_class].mean(axis=1) - exprs[:, ~in_class].mean(axis=1)
+        signatures[label] = list(np.argsort(-diff)[:n_genes])
+    return signatures
+
+
+class TestCrossValidation(TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        # 4 classes x 6 groups x 2 replicates, 5 marker genes per class
+        self.target = np.repeat(["a", "b", "c", "d"], 12)
+        self.groups = np.repeat(np.arange(24), 2)
+        exprs = rng.gamma(1., size=(100, len(self.target)))
+        for i, label in enumerate(["a", "b", "c", "d"]):
+            exprs[i * 5:(i + 1) * 5, self.target == label] += 5
+        self.exprs_file = os.path.join(tempfile.mkdtemp(), "exprs.npy")
+        np.save(self.exprs_file, exprs)
+
+    def test_group_folds(self):
+        folds = group_folds(self.target, self.groups, 3, seed=1)
+        # replicates are in the same fold and every class is in every fold
+        self.assertTrue((folds[::2] == folds[1::2]).all())
+        for label in ["a", "b", "c", "d"]:
+            self.assertEqual([4, 4, 4], list(np.bincount(folds[self.target == label])))
+
+    def test_cross_validate(self):
+        finished = []
+        confusion, folds = cross_validate(self.exprs_file, self.target, self.groups, top_genes, n_splits=3,
+                                          signature_kwargs={"n_genes": 3}, n_jobs=2, seed=1,
+                                          callback=lambda fold, _: finished.append(fold))
+        self.assertEqual([0, 1, 2], sorted(finished))
+        self.assertEqual([0, 1, 2], [fold["fold"] for fold in folds])
+        np.testing.assert_array_equal(np.diag([12, 12, 12, 12]), confusion.values)
+        self.assertEqual(confusion.values.tolist(), sum(fold["confusion"] for fold in folds).values.tolist())
+        self.assertTrue(set(folds[0]["signatures"]["a"]) <= {0, 1, 2, 3, 4})
@@ -0,0 +1,27 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from pyfantom.expression_store import convert_osc
+
+
+class TestExpressionStore(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_trailing_blank_lines(self):
+        # blank lines at the end of the table are skipped by the reader and must not be counted
+        osc_file = os.path.join(self.tmp_dir, "dummy.osc.txt")
+        shutil.copy("testdata/dummy.osc.txt", osc_file)
+        with open(osc_file, 'a') as f:
+            f.write("\n  \n")
+        expected = convert_osc("testdata/dummy.osc.txt", os.path.join(self.tmp_dir, "expected"))
+        store = convert_osc(osc_file, os.path.join(self.tmp_dir, "store"))
+        self.assertTrue(np.array_equal(expected.exprs, store.exprs))
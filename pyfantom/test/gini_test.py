@@ -0,0 +1,55 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+from pyfantom.gini import gini, gini_signatures, write_signatures_gmt
+from pyfantom.gmt import GMTStore
+
+
+def gini_reference(array):
+    array = np.sort(array)
+    index = np.arange(1, array.shape[0] + 1)
+    n = array.shape[0]
+    return np.sum((2 * index - n - 1) * array) / (n * np.sum(array))
+
+
+class TestGini(TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.target = rng.choice(["g{}".format(i) for i in range(8)], 60)
+        self.exprs = rng.gamma(.3, 10, size=(300, 60))
+        self.genes = ["gene{}".format(i) for i in range(300)]
+
+    def test_gini(self):
+        expected = [gini_reference(row) for row in self.exprs]
+        np.testing.assert_allclose(expected, gini(self.exprs))
+
+    def test_signatures(self):
+        # the vectorized selection must be equal to a gene by gene loop over the aggregated matrix
+        kwargs = {"min_gini": .5, "max_rk": 2, "min_expr": 1, "max_rel_rk": .33}
+        signatures = gini_signatures(self.exprs, self.target, **kwargs)
+        aggregated = pd.DataFrame(self.exprs.T).groupby(self.target).median().T
+        expected = dict((group, []) for group in aggregated.columns)
+        for i, row in aggregated.iterrows():
+            if gini_reference(row.values) < kwargs["min_gini"]:
+                continue
+            for rank, group in enumerate(row.sort_values(ascending=False).index[:kwargs["max_rk"]]):
+                gene_rank = (aggregated[group] > row[group]).sum() / aggregated.shape[0]
+                if row[group] >= kwargs["min_expr"] and gene_rank <= kwargs["max_rel_rk"]:
+                    expected[group].append(i)
+        self.assertEqual(expected, signatures)
+        self.assertTrue(any(len(rows) > 0 for rows in signatures.values()))
+
+    def test_write_signatures_gmt(self):
+        signatures = gini_signatures(self.exprs, self.target, min_gini=.5)
+        gmt_file = os.path.join(tempfile.mkdtemp(), "signatures.gmt")
+        write_signatures_gmt(signatures, self.genes, gmt_file, description="Gini>=0.5, Rank<=3, RPKM>=1")
+        store = GMTStore([gmt_file])
+        for group, rows in signatures.items():
+            if len(rows) > 0:
+                self.assertEqual(set(self.genes[i] for i in rows), set(store.genes("signatures", group)))
+        self.assertEqual({"Gini>=0.5, Rank<=3, RPKM>=1"}, set(store.signatures.description))
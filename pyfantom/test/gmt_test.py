@@ -0,0 +1,48 @@
+import glob
+import os
+import tempfile
+from unittest import TestCase
+
+from pyfantom.gmt import GMTStore, read_gmt, write_gmt
+
+
+class TestGMTStore(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.gmt_files = sorted(glob.glob("../../gmt/*.gmt"))
+        cls.store = GMTStore(cls.gmt_files)
+        # plain python sets as reference
+        cls.signatures = dict()
+        for gmt_file in cls.gmt_files:
+            source = os.path.splitext(os.path.basename(gmt_file))[0]
+            for name, _, genes in read_gmt(gmt_file):
+                cls.signatures[(source, name)] = set(genes) - {"-"}
+
+    def test_genes(self):
+        self.assertEqual(len(self.signatures), len(self.store))
+        for (source, name), genes in self.signatures.items():
+            self.assertEqual(genes, set(self.store.genes(source, name)))
+        self.assertNotIn("-", self.store.gene_index)
+        self.assertEqual(63, self.store.signatures.n_missing.loc["exp.fantom5.tissue.grst.symbol"].sum())
+
+    def test_signatures_with_gene(self):
+        for gene in ["ALB", "CD14", "PTPRC", "NOT_A_GENE"]:
+            expected = sorted(key for key, genes in self.signatures.items() if gene in genes)
+            self.assertEqual(expected, sorted(self.store.signatures_with_gene(gene)))
+
+    def test_jaccard(self):
+        jaccard = self.store.jaccard()
+        keys = list(self.signatures)[::20]
+        for a in keys:
+            for b in keys:
+                expected = len(self.signatures[a] & self.signatures[b]) / len(self.signatures[a] | self.signatures[b])
+                self.assertAlmostEqual(expected, jaccard.loc[a, b])
+
+    def test_write_gmt(self):
+        source = "exp.gtex.tissue.grst.symbol"
+        gmt_file = os.path.join(tempfile.mkdtemp(), source + ".gmt")
+        write_gmt(self.store.to_dict(source), gmt_file)
+        store = GMTStore([gmt_file])
+        for name, genes in self.store.to_dict(source).items():
+            self.assertEqual(set(genes), set(store.genes(source, name)))
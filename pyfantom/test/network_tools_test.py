@@ -1,3 +1,7 @@
+import os
+import shutil
+import tempfile
+from collections import Counter
 from unittest import TestCase
 
 import pandas as pd
@@ -890,3 +894,49 @@ class TestNetworkTools(TestCase):
         set_exc = set(graph_exc.nodes())
         set_inc = set(graph_inc.nodes())
         self.assertEqual(delimiter_nodes, set_inc - set_exc)
+
+    def test_build_superelement_graph(self):
+        delimiter_nodes = ["FF:0000002", "FF:0000004", "FF:0000003", "FF:0000210"]
+        graph = build_superelement_graph(self.obo, self.col_vars.obo_id, delimiter_nodes, self.prepare_graph())
+        self.assertEqual(self.SUPERELEMENTS, set(graph.nodes()))
+        delimiter_nodes = ["FF:0200009", "FF:0200006", "FF:0200005", "FF:0200008", "FF:0300101"]
+        graph1 = build_superelement_graph(self.obo, self.col_vars.obo_id, delimiter_nodes, self.prepare_graph(),
+                                          inclusive=True)
+        graph2 = self.prepare_graph()
+        for node in list(graph2.nodes()):
+            add_superelements_to_graph(self.obo, node, graph2, delimiter_nodes, inclusive=True)
+        self.assertEqual(set(map(frozenset, graph2.edges())), set(map(frozenset, graph1.edges())))
+
+    def test_get_delimiter_nodes(self):
+        # the counts must be equal to the ones of the Counter in notebook 04
+        cntr = Counter()
+        for obo_id in self.col_vars.obo_id:
+            for term in self.obo.super_terms(obo_id):
+                cntr[term.id] += 1
+        delim_df = get_delimiter_nodes(self.obo, self.col_vars.obo_id)
+        self.assertEqual(dict(cntr), delim_df["count"].to_dict())
+        self.assertEqual(set(obo_id for obo_id, count in cntr.items() if count >= len(self.col_vars)),
+                         set(delim_df[delim_df["count"] == len(self.col_vars)].index))
+        delimiter = delim_df[delim_df.delimiter == 1]
+        self.assertIn("NCBITaxon:9606", delimiter.index)
+        self.assertTrue(delim_df.loc["FF:0000002", "delimiter"] == 0)
+
+    def test_build_and_export_tree(self):
+        # the exported graph is named with obo-ids, the returned one only relabelled on request
+        out_dir = tempfile.mkdtemp()
+        try:
+            graph = build_and_export_tree(self.obo, "FF:0000002", os.path.join(out_dir, "tree.tsv"), maxdepth=2)
+            nodes = pd.read_csv(os.path.join(out_dir, "tree.nodes.tsv"), sep="\t")
+            self.assertEqual(set(nodes.id), set(graph.nodes()))
+            # the names are only added to the exported graph
+            self.assertTrue(all("name" not in data for _, data in graph.nodes(data=True)))
+            graph = build_and_export_tree(self.obo, "FF:0000002", os.path.join(out_dir, "tree.tsv"), maxdepth=2,
+                                          relabel=True)
+            self.assertEqual(set(tag2name(self.obo, obo_id) for obo_id in nodes.id), set(graph.nodes()))
+            # an empty graph is exported as empty tables
+            graph = build_and_export_tree(self.obo, "FF:0000002", os.path.join(out_dir, "empty.tsv"), maxdepth=1)
+            self.assertEqual(0, len(graph))
+            self.assertEqual(0, len(pd.read_csv(os.path.join(out_dir, "empty.tsv"), sep="\t")))
+            self.assertEqual(["id"], list(pd.read_csv(os.path.join(out_dir, "empty.nodes.tsv"), sep="\t").columns))
+        finally:
+            shutil.rmtree(out_dir)
@@ -0,0 +1,53 @@
+import io
+from unittest import TestCase
+
+from orangecontrib.bio.ontology import OBOOntology as OrangeOntology
+from pyfantom.obo import OBOOntology
+
+
+class TestOBOOntology(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.orange = OrangeOntology()
+        cls.orange.load(open("testdata/ff-phase2-140729.obo"))
+        cls.obo = OBOOntology()
+        cls.obo.load(open("testdata/ff-phase2-140729.obo"))
+
+    def test_terms(self):
+        # the terms must be equal to the ones parsed by orange
+        self.assertEqual(set(t.id for t in self.orange.terms()), set(t.id for t in self.obo.terms()))
+        for term in self.orange.terms():
+            self.assertEqual(term.name, self.obo.term(term.id).name)
+            self.assertEqual(term.tags(), self.obo.term(term.id).tags())
+            self.assertEqual(set(t.id for t in self.orange.parent_terms(term)),
+                             set(t.id for t in self.obo.parent_terms(term.id)))
+
+    def test_relations(self):
+        self.assertEqual(set(t.id for t in self.orange.root_terms()), set(t.id for t in self.obo.root_terms()))
+        for term_id in ["FF:0000001", "FF:0000210", "UBERON:0001062", "FF:10100-102D1"]:
+            self.assertEqual(set(t.id for t in self.orange.super_terms(term_id)),
+                             set(t.id for t in self.obo.super_terms(term_id)))
+            self.assertEqual(set(t.id for t in self.orange.sub_terms(term_id)),
+                             set(t.id for t in self.obo.sub_terms(term_id)))
+            self.assertEqual(set(t.id for t in self.orange.child_terms(term_id)),
+                             set(t.id for t in self.obo.child_terms(term_id)))
+
+    def test_to_networkx(self):
+        for terms in [None, ["FF:10100-102D1", "FF:11931-125I5"]]:
+            expected = self.orange.to_networkx(terms)
+            graph = self.obo.to_networkx(terms)
+            self.assertEqual(set(expected.nodes()), set(graph.nodes()))
+            self.assertEqual(sorted(expected.edges(data="label")), sorted(graph.edges(data="label")))
+
+    def test_write(self):
+        expected, written = io.StringIO(), io.StringIO()
+        self.orange.write(expected)
+        self.obo.write(written)
+        self.assertEqual(expected.getvalue(), written.getvalue())
+
+    def test_missing_id(self):
+        obo = OBOOntology()
+        stream = io.StringIO("format-version: 1.2\n\n[Term]\nid: A\nname: A\n\n[Term]\nname: B\nis_a: A\n")
+        with self.assertRaisesRegex(ValueError, "stanza without id at line 7"):
+            obo.load(stream)
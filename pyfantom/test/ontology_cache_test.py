@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from orangecontrib.bio.ontology import OBOOntology
+from pyfantom.network_tools import is_sample_id
+from pyfantom.ontology_cache import load_ontology, read_snapshot_meta, _snapshot_dir
+from pyfantom.parse_ontology import get_sample_types, get_sample_type_from_ontology
+
+
+class TestOntologyCache(TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.obo_file = os.path.join(self.cache_dir, "ff-phase2-140729.obo")
+        shutil.copy("testdata/ff-phase2-140729.obo", self.obo_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_snapshot(self):
+        # the terms of the snapshot must be equal to the ones parsed by OBOOntology
+        load_ontology(self.obo_file, self.cache_dir)
+        cached = load_ontology(self.obo_file, self.cache_dir)
+        obo = OBOOntology()
+        obo.load(open(self.obo_file))
+        for term in obo.terms():
+            self.assertEqual(term.name, cached.term(term.id).name)
+            self.assertEqual(term.tags(), cached.term(term.id).tags())
+            self.assertEqual(set(t.id for t in obo.parent_terms(term)), set(cached.parent_term_ids(term.id)))
+
+    def test_invalidate(self):
+        load_ontology(self.obo_file, self.cache_dir)
+        # touching the file does not invalidate the snapshot, changing the content does.
+        os.utime(self.obo_file, (0, 0))
+        self.assertIn("FF:0000001", load_ontology(self.obo_file, self.cache_dir))
+        with open(self.obo_file, 'a') as f:
+            f.write("[Term]\nid: FF:XXX\nname: new term\nis_a: FF:0000001\n\n")
+        cached = load_ontology(self.obo_file, self.cache_dir)
+        self.assertEqual("new term", cached.term("FF:XXX").name)
+        self.assertEqual(["FF:0000001"], cached.parent_term_ids("FF:XXX"))
+
+    def test_touch(self):
+        # after touching the file, the new modification time is stored in the snapshot
+        load_ontology(self.obo_file, self.cache_dir)
+        os.utime(self.obo_file, (0, 0))
+        load_ontology(self.obo_file, self.cache_dir)
+        snapshot_dir = _snapshot_dir(self.obo_file, self.cache_dir)
+        self.assertEqual(0, read_snapshot_meta(snapshot_dir)["mtime"])
+
+    def test_same_name(self):
+        # obo files with the same name in different directories have their own snapshots
+        other_dir = os.path.join(self.cache_dir, "other")
+        os.makedirs(other_dir)
+        other_file = os.path.join(other_dir, os.path.basename(self.obo_file))
+        with open(other_file, 'w') as f:
+            f.write("[Term]\nid: FF:XXX\nname: new term\n\n")
+        load_ontology(self.obo_file, self.cache_dir)
+        load_ontology(other_file, self.cache_dir)
+        self.assertNotEqual(_snapshot_dir(self.obo_file, self.cache_dir), _snapshot_dir(other_file, self.cache_dir))
+        self.assertIn("FF:0000001", load_ontology(self.obo_file, self.cache_dir))
+        self.assertNotIn("FF:0000001", load_ontology(other_file, self.cache_dir))
+
+    def test_sample_types(self):
+        # the sample types from the snapshot must be equal to get_sample_type_from_ontology
+        load_ontology(self.obo_file, self.cache_dir)
+        cached = load_ontology(self.obo_file, self.cache_dir)
+        self.assertIsNotNone(cached.sample_type_bits)
+        sample_types = get_sample_types(cached)
+        obo = OBOOntology()
+        obo.load(open(self.obo_file))
+        for obo_id, sample_type in sample_types.items():
+            expected = get_sample_type_from_ontology(obo, obo.term(obo_id))
+            if len(expected) > 1:
+                self.assertEqual("multiple", sample_type)
+            else:
+                self.assertEqual(expected[0] if expected else None, sample_type)
+        self.assertEqual(sum(1 for term in obo.terms() if is_sample_id(term.id)), len(sample_types))
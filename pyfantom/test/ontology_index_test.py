@@ -0,0 +1,29 @@
+from unittest import TestCase
+
+from orangecontrib.bio.ontology import OBOOntology
+from pyfantom.ontology_index import OntologyIndex
+
+
+class TestOntologyIndex(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.obo = OBOOntology()
+        cls.obo.load(open("testdata/ff-phase2-140729.obo"))
+        cls.index = OntologyIndex(cls.obo)
+
+    def test_super_terms(self):
+        # the transitive closure must be equal to the one computed by OBOOntology
+        for term in self.obo.terms():
+            expected = set(t.id for t in self.obo.super_terms(term))
+            self.assertEqual(expected, set(self.index.super_term_ids(term.id)))
+
+    def test_sub_terms(self):
+        for term_id in ["FF:0000001", "FF:0000210", "UBERON:0001062", "FF:10100-102D1"]:
+            expected = set(t.id for t in self.obo.sub_terms(term_id))
+            self.assertEqual(expected, set(self.index.sub_term_ids(term_id)))
+
+    def test_is_under(self):
+        self.assertTrue(self.index.is_under("FF:10100-102D1", "FF:0000004"))
+        self.assertFalse(self.index.is_under("FF:10100-102D1", "FF:0000002"))
+        self.assertFalse(self.index.is_under("FF:0000004", "FF:10100-102D1"))
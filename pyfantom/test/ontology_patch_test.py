@@ -0,0 +1,84 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from orangecontrib.bio.ontology import OBOOntology, OBOObject
+from pyfantom.ontology_cache import load_ontology
+from pyfantom.ontology_index import OntologyIndex
+from pyfantom.ontology_patch import PatchedOntology, read_journal, write_journal
+from pyfantom.parse_ontology import HOUR_TERM, is_time_term, ontology_to_time
+
+HUMAN_SAMPLE = "FF:0000210"
+CD4_T_CELL = "FF:0000031"
+TERMS = ["FF:11793-124C2", "FF:11796-124C5", "FF:11907-125F8"]
+
+
+class TestOntologyPatch(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.base = load_ontology("testdata/ff-phase2-140729.obo", None)
+
+    def assertIndexEqual(self, expected, index):
+        self.assertEqual(expected.term_ids, index.term_ids)
+        for term_id in expected.term_ids:
+            self.assertEqual(set(expected.parent_term_ids(term_id)), set(index.parent_term_ids(term_id)))
+            self.assertEqual(set(expected.super_term_ids(term_id)), set(index.super_term_ids(term_id)))
+            self.assertEqual(set(expected.sub_term_ids(term_id)), set(index.sub_term_ids(term_id)))
+
+    def test_add(self):
+        # corrections like in notebook 03 must give the same index as the modified orange ontology
+        patched = PatchedOntology(self.base)
+        patched.add_term("GS:0001", "meta node")
+        patched.add_subset("GS:0001", "correction_gs01")
+        for parent_id in [HUMAN_SAMPLE, CD4_T_CELL]:
+            patched.add_is_a("GS:0001", parent_id)
+        for term_id in TERMS:
+            patched.add_is_a(term_id, "GS:0001")
+
+        obo = OBOOntology()
+        obo.load(open("testdata/ff-phase2-140729.obo"))
+        term = OBOObject("Term", id="GS:0001", name="meta node")
+        term.add_tag("subset", "correction_gs01")
+        for parent_id in [HUMAN_SAMPLE, CD4_T_CELL]:
+            term.add_tag("is_a", parent_id, comment=obo.term(parent_id).name)
+        obo.add_object(term)
+        for term_id in TERMS:
+            obo.term(term_id).add_tag("is_a", "GS:0001", comment="meta node")
+
+        self.assertIndexEqual(OntologyIndex(obo), patched)
+        self.assertEqual(obo.term("GS:0001").tags(), patched.term("GS:0001").tags())
+        self.assertEqual(obo.term(TERMS[0]).tags(), patched.term(TERMS[0]).tags())
+        self.assertTrue(patched.is_under(TERMS[0], "GS:0001"))
+
+    def test_remove(self):
+        # the incremental update must be equal to rebuilding the index from the patched parents
+        patched = PatchedOntology(self.base)
+        patched.remove_is_a("FF:0000031", "FF:0000002")
+        patched.remove_is_a("FF:11931-125I5", "FF:0011169")
+        self.assertIndexEqual(OntologyIndex(patched), patched)
+        self.assertFalse(patched.is_under("FF:11931-125I5", "FF:0011169"))
+        # adding the relation again restores the base index
+        patched.add_is_a("FF:0000031", "FF:0000002")
+        patched.add_is_a("FF:11931-125I5", "FF:0011169")
+        self.assertIndexEqual(self.base, patched)
+
+    def test_journal(self):
+        patched = PatchedOntology(self.base)
+        patched.add_term("GS:0001", "meta node")
+        patched.add_is_a("GS:0001", HUMAN_SAMPLE)
+        patched.add_is_a(TERMS[0], "GS:0001")
+        patched.remove_is_a(TERMS[0], HUMAN_SAMPLE)
+        journal_file = os.path.join(tempfile.mkdtemp(), "corrections.jsonl")
+        write_journal(patched.journal, journal_file)
+        reapplied = PatchedOntology(self.base, read_journal(journal_file))
+        self.assertEqual(patched.journal, reapplied.journal)
+        self.assertIndexEqual(patched, reapplied.to_index())
+
+    def test_time_lookup(self):
+        # the memoized time terms must be discarded when the ontology changes
+        patched = PatchedOntology(self.base)
+        self.assertFalse(is_time_term(patched, "GS:0001"))
+        patched.add_term("GS:0001", "99 hour sample")
+        patched.add_is_a("GS:0001", HOUR_TERM)
+        self.assertEqual("99hr", ontology_to_time(patched, "GS:0001"))
@@ -0,0 +1,46 @@
+from unittest import TestCase
+
+import pandas as pd
+
+from orangecontrib.bio.ontology import OBOOntology, OBOObject
+from pyfantom.parse_ontology import DAY_TERM, HOUR_TERM, get_time_terms, is_time_term, \
+    ontology_to_time, process_sample_name, process_sample_names
+
+
+class TestParseOntology(TestCase):
+
+    def setUp(self):
+        with open("testdata/column_vars.txt") as f:
+            self.sample_infos = [line.strip() for line in f]
+
+    def test_process_sample_names(self):
+        # the vectorized version must be equal to process_sample_name for every header
+        df = process_sample_names(self.sample_infos)
+        for i, sample_info in enumerate(self.sample_infos):
+            self.assertEqual(process_sample_name(sample_info), df.iloc[i].to_dict())
+
+    def test_duplicated_index(self):
+        # rows are matched by position, not by the (possibly duplicated) index labels
+        names = pd.Series(self.sample_infos[:3], index=["a", "a", "b"])
+        df = process_sample_names(names)
+        self.assertEqual(["a", "a", "b"], list(df.index))
+        self.assertEqual(["00hr"] * 3, list(df.time))
+        self.assertEqual(["biol_rep1", "biol_rep2", "biol_rep3"], list(df.biol_rep))
+        with self.assertRaisesRegex(AssertionError, r"multiple times per unit day not allowed in rows \['b'\]"):
+            process_sample_names(pd.Series(["tpm of A, 1hr.CNhs1.1-1", "tpm of B, day01, day02.CNhs2.2-2"],
+                                           index=["a", "b"]))
+
+    def test_time_lookup_orange(self):
+        # the memoized time terms are rebuilt when an orange ontology is modified in place
+        obo = OBOOntology()
+        obo.load(open("testdata/ff-phase2-140729.obo"))
+        self.assertEqual("00hr", ontology_to_time(obo, "FF:0000357"))
+        self.assertFalse(is_time_term(obo, "GS:0001"))
+        term = OBOObject("Term", id="GS:0001", name="99 hour sample")
+        term.add_tag("is_a", HOUR_TERM)
+        obo.add_object(term)
+        self.assertEqual("99hr", ontology_to_time(obo, "GS:0001"))
+        # a tag added to an existing term is seen after rebuilding orange's relation cache
+        obo.term("FF:0000357").add_tag("is_a", DAY_TERM)
+        obo._cache_validate(force=True)
+        self.assertIn("FF:0000357", get_time_terms(obo)[2])
@@ -0,0 +1,41 @@
+from unittest import TestCase
+
+import numpy as np
+from scipy.stats import mannwhitneyu, rankdata
+
+from pyfantom.scoring import SignatureScorer, average_ranks
+
+
+class TestScoring(TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        self.genes = ["g{}".format(i) for i in range(200)]
+        self.exprs = rng.gamma(.5, size=(200, 30))
+        self.signatures = {
+            "first": self.genes[:10],
+            "random": list(rng.choice(self.genes, 25, replace=False)),
+            "unknown": ["not_a_gene"],
+        }
+        self.exprs[:10, :5] += 5
+
+    def test_average_ranks(self):
+        exprs = np.round(self.exprs, 1)  # with ties
+        np.testing.assert_array_equal(rankdata(exprs, axis=0), average_ranks(exprs))
+
+    def test_pvalues(self):
+        # the p-values must be equal to the (tie-free) asymptotic Mann-Whitney U test
+        pvalues = SignatureScorer(self.genes, self.signatures).score(self.exprs, value="pvalue")
+        for name in ["first", "random"]:
+            in_signature = np.isin(self.genes, self.signatures[name])
+            for j in range(self.exprs.shape[1]):
+                _, expected = mannwhitneyu(self.exprs[in_signature, j], self.exprs[~in_signature, j],
+                                           use_continuity=False, alternative="greater", method="asymptotic")
+                self.assertAlmostEqual(expected, pvalues.loc[name, j])
+        self.assertTrue(pvalues.loc["unknown"].isnull().all())
+        self.assertTrue((pvalues.loc["first", :4] < 1e-5).all())
+
+    def test_chunks(self):
+        scorer = SignatureScorer(self.genes, self.signatures)
+        expected = scorer.score(self.exprs)
+        np.testing.assert_allclose(expected.values, scorer.score(self.exprs, chunk_size=7, n_jobs=3).values)